@@ -0,0 +1,184 @@
+"""
+Read replicas for safe requests, with read-your-writes.
+
+``ReplicaRoutingMiddleware`` marks GET/HEAD/OPTIONS requests as allowed to
+read from a replica; ``ReplicaRouter`` then sends their reads to one of
+``DATABASE_REPLICAS``, picked once per request. Everything else reads and
+writes the primary, including management commands and anything run
+outside a request.
+
+After a write a user is pinned to the primary for
+``DATABASE_REPLICA_PIN_SECONDS``, so their next reads see it despite
+replication lag. Pins live in the cache, shared by every process when
+Redis is configured. Only the user who made an unsafe request is pinned;
+others see the write once their replica has it. Cache versions are read
+from the same database as the data they cover (see tasks.cache), so a
+lagging replica cannot cache old rows under a new version.
+
+A replica that fails to connect or raises a connection error is skipped
+for ``DATABASE_REPLICA_RETRY_SECONDS``; with none left, reads go to the
+primary.
+"""
+import contextvars
+import random
+import time
+
+import jwt
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, InterfaceError, OperationalError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+
+_routing = contextvars.ContextVar('replica_routing', default=None)
+_down_until = {}
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 10)
+
+
+def _pin_key(user_id):
+    return f'db-pin:{user_id}'
+
+
+def pin(user_ids):
+    """Send the reads of ``user_ids`` to the primary for the pin window."""
+    if replicas() and user_ids:
+        cache.set_many({_pin_key(user_id): True for user_id in user_ids}, pin_seconds())
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(_pin_key(user_id)) is not None
+
+
+def mark_down(alias):
+    _down_until[alias] = time.monotonic() + getattr(settings, 'DATABASE_REPLICA_RETRY_SECONDS', 30)
+
+
+def is_up(alias):
+    return _down_until.get(alias, 0) <= time.monotonic()
+
+
+def _connects(alias):
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        mark_down(alias)
+        return False
+    return True
+
+
+class Routing:
+    """The routing state of one request; the replica is picked on its first read."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._alias = None
+        self._picked = False
+
+    def read_alias(self):
+        if not self._picked:
+            self._picked = True
+            if not is_pinned(self.user_id):
+                candidates = [alias for alias in replicas() if is_up(alias)]
+                random.shuffle(candidates)
+                self._alias = next((alias for alias in candidates if _connects(alias)), None)
+        return self._alias
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        # Inside a transaction on the primary, read what it has written so far
+        if routing is None or connections['default'].in_atomic_block:
+            return None
+        return routing.read_alias()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {'default', *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+@receiver(connection_created)
+def _watch_replica(sender, connection, **kwargs):
+    if connection.alias in replicas() and _mark_down_on_error not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_mark_down_on_error)
+
+
+def _mark_down_on_error(execute, sql, params, many, context):
+    try:
+        return execute(sql, params, many, context)
+    except (OperationalError, InterfaceError):
+        mark_down(context['connection'].alias)
+        raise
+
+
+def _request_user_id(request):
+    # JWT users are only authenticated inside the view, so read the claim without verifying the
+    # token. It only chooses where to read from; the view still authenticates the request.
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    header = request.headers.get('Authorization', '').split()
+    if len(header) == 2 and header[0] == 'Bearer':
+        try:
+            claims = jwt.decode(header[1], options={'verify_signature': False})
+        except jwt.InvalidTokenError:
+            return None
+        return claims.get(settings.SIMPLE_JWT.get('USER_ID_CLAIM', 'user_id'))
+    return None
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        self.finish(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        self.finish(request, response)
+        return response
+
+    def start(self, request):
+        if not replicas() or request.method not in SAFE_METHODS:
+            return _routing.set(None)
+        return _routing.set(Routing(_request_user_id(request)))
+
+    def finish(self, request, response):
+        if replicas() and request.method not in SAFE_METHODS and response.status_code < 400:
+            user_id = _request_user_id(request)
+            if user_id is not None:
+                pin([user_id])
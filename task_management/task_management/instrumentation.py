@@ -0,0 +1,344 @@
+"""
+Per-view request metrics, served in the Prometheus text format on /metrics.
+
+``InstrumentationMiddleware`` times every request and files it under the
+URL name of its view (``task-list``, ``taskhistory-list``, ...), together
+with the number and total time of its SQL queries and the time spent in
+serializers and renderers. Everything is aggregated in this process's
+memory; a scrape of /metrics reports the process that answers it.
+
+Queries are counted by a wrapper installed on every database connection,
+which reads the current request's stats from a context variable, so it
+also sees the queries of sync views that ASGI runs in a worker thread.
+Other tools that watch queries (``nplusone``) register a listener with
+``add_query_listener`` rather than wrapping every connection again.
+
+Requests slower than ``SLOW_REQUEST_MS`` are logged with their view, time
+and query count. ``SQL_SAMPLE_RATE`` of requests also keep their SQL, and
+if one of those is slow its log line lists the query fingerprints (SQL
+with literals and IN lists collapsed) by count and time, which is how an
+N+1 shows up. At a low rate this is cheap enough to leave on.
+
+Databases with a connection pool (``settings.DATABASE_POOL``) also report
+its size, waits and lost connections, by database alias.
+"""
+import contextvars
+import hmac
+import logging
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SLOW_REQUEST_MS': 1000,
+    'SQL_SAMPLE_RATE': 0.0,
+    'METRICS_TOKEN': None,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by view, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time until the response is returned, by view.', LATENCY_BUCKETS),
+    'db_queries_per_request': ('histogram', 'SQL queries per request, by view.', QUERY_BUCKETS),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in SQL queries, by view.'),
+    'serialization_duration_seconds': ('histogram', 'Time spent in serializers and renderers, excluding SQL, by view.', LATENCY_BUCKETS),
+    'response_cache_requests_total': ('counter', 'Cacheable requests by view and whether the response cache had them.'),
+}
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """Counters and histograms keyed by metric name and label values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._collectors = []
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        """Register a callable returning ``(name, type, help, [(labels, value), ...])`` tuples on every scrape."""
+        self._collectors.append(collector)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def render(self):
+        with self._lock:
+            values = [(name, labels, value.counts[:], value.sum) if isinstance(value, Histogram) else (name, labels, value, None)
+                      for (name, labels), value in self._values.items()]
+        by_name = defaultdict(list)
+        for name, labels, value, total in values:
+            by_name[name].append((labels, value, total))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text = METRICS[name][:2]
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for labels, value, total in sorted(by_name[name]):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip((*METRICS[name][2], '+Inf'), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {total}')
+                lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_labels(tuple(sorted(labels.items())))} {value}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+registry = Registry()
+
+
+class RequestStats:
+    def __init__(self, sample_sql):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.serializing = False
+        self.sql = [] if sample_sql else None
+
+
+_query_listeners = []
+
+
+def add_query_listener(listener):
+    """Call ``listener(sql, elapsed)`` after every query run on any connection."""
+    if listener not in _query_listeners:
+        _query_listeners.append(listener)
+    instrument_connections()
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None and not _query_listeners:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+            if stats.sql is not None:
+                stats.sql.append((sql, elapsed))
+        for listener in _query_listeners:
+            listener(sql, elapsed)
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def instrument_connections():
+    # Connections opened before this module was imported missed connection_created
+    for connection in connections.all(initialized_only=True):
+        _instrument_connection(None, connection)
+
+
+def _timed(prop):
+    # Times the outermost serializer .data or response render of a request, minus the SQL it runs
+    getter = prop.fget
+
+    def timed(self):
+        stats = _current.get()
+        if stats is None or stats.serializing:
+            return getter(self)
+        stats.serializing = True
+        start, db_time = time.perf_counter(), stats.db_time
+        try:
+            return getter(self)
+        finally:
+            stats.serializing = False
+            stats.serialization_time += time.perf_counter() - start - (stats.db_time - db_time)
+
+    timed.instrumented = True
+    return property(timed)
+
+
+def install():
+    from rest_framework.response import Response
+    from rest_framework.serializers import BaseSerializer
+
+    for cls, name in ((BaseSerializer, 'data'), (Response, 'rendered_content')):
+        prop = cls.__dict__[name]
+        if not getattr(prop.fget, 'instrumented', False):
+            setattr(cls, name, _timed(prop))
+    instrument_connections()
+
+
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+VALUE_ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+
+
+def fingerprint(sql):
+    """The shape of a query: literals and placeholders become ?, IN lists and VALUES rows become (...)."""
+    return ' '.join(VALUE_ROWS.sub('(...)', IN_LISTS.sub('(...)', SQL_LITERALS.sub('?', sql))).split())
+
+
+def fingerprints(sql):
+    summary = defaultdict(lambda: [0, 0.0])
+    for statement, elapsed in sql:
+        entry = summary[fingerprint(statement)]
+        entry[0] += 1
+        entry[1] += elapsed
+    return sorted(summary.items(), key=lambda item: -item[1][1])
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = get_config()
+        self.slow_seconds = config['SLOW_REQUEST_MS'] / 1000
+        self.sample_rate = config['SQL_SAMPLE_RATE']
+        install()
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token, start = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats, start)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, start = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats, start)
+        return response
+
+    def start(self):
+        stats = RequestStats(sample_sql=self.sample_rate and random.random() < self.sample_rate)
+        return stats, _current.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, start):
+        elapsed = time.perf_counter() - start
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else 'unmatched'
+        registry.inc('http_requests_total', {'view': view, 'method': request.method, 'status': response.status_code})
+        registry.observe('http_request_duration_seconds', {'view': view}, elapsed)
+        registry.observe('db_queries_per_request', {'view': view}, stats.queries)
+        registry.inc('db_query_duration_seconds_total', {'view': view}, stats.db_time)
+        if stats.serialization_time:
+            registry.observe('serialization_duration_seconds', {'view': view}, stats.serialization_time)
+        if elapsed >= self.slow_seconds:
+            self.log_slow(request, view, elapsed, stats)
+
+    def log_slow(self, request, view, elapsed, stats):
+        message = (f'Slow request {request.method} {request.path} ({view}): {elapsed * 1000:.0f} ms, '
+                   f'{stats.queries} queries in {stats.db_time * 1000:.0f} ms, '
+                   f'serialization {stats.serialization_time * 1000:.0f} ms')
+        if stats.sql:
+            message += ''.join(
+                f'\n  {count}x {total * 1000:.1f} ms  {statement}' for statement, (count, total) in fingerprints(stats.sql)[:10]
+            )
+        logger.warning(message)
+
+
+# (metric, type, help, psycopg_pool stat, scale)
+POOL_METRICS = (
+    ('db_pool_size', 'gauge', 'Connections held by the pool, in use or idle.', 'pool_size', 1),
+    ('db_pool_available', 'gauge', 'Idle connections in the pool.', 'pool_available', 1),
+    ('db_pool_max_size', 'gauge', 'Connections the pool may open.', 'pool_max', 1),
+    ('db_pool_requests_waiting', 'gauge', 'Requests waiting for a connection.', 'requests_waiting', 1),
+    ('db_pool_requests_total', 'counter', 'Connections handed out by the pool.', 'requests_num', 1),
+    ('db_pool_requests_queued_total', 'counter', 'Requests that had to wait for a connection.', 'requests_queued', 1),
+    ('db_pool_wait_seconds_total', 'counter', 'Time requests spent waiting for a connection.', 'requests_wait_ms', 0.001),
+    ('db_pool_timeouts_total', 'counter', 'Requests that gave up waiting for a connection.', 'requests_errors', 1),
+    ('db_pool_connections_lost_total', 'counter', 'Broken connections found by the health check and replaced.', 'connections_lost', 1),
+)
+
+
+def pool_metrics():
+    stats = {}
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is not None:
+            stats[alias] = pool.get_stats()
+    if not stats:
+        return []
+    return [
+        (name, kind, help_text, [({'database': alias}, values.get(stat, 0) * scale) for alias, values in stats.items()])
+        for name, kind, help_text, stat, scale in POOL_METRICS
+    ]
+
+
+registry.add_collector(pool_metrics)
+
+
+def metrics(request):
+    token = get_config()['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
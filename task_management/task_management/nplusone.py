@@ -0,0 +1,187 @@
+"""
+N+1 query detection for development and tests.
+
+Queries are grouped by fingerprint (see ``instrumentation.fingerprint``).
+A fingerprint run ``THRESHOLD`` times or more in one request is reported
+with the code that ran it: the serializer field being rendered, if any,
+and the first frame of project code.
+
+- ``NPlusOneMiddleware`` logs findings per request, or raises with
+  ``NPLUSONE['RAISE']``. It is off unless ``NPLUSONE['ENABLED']``, which
+  defaults to DEBUG; ``NPLUSONE_RAISE=1 python manage.py test`` turns both
+  on, so an N+1 anywhere in an API test fails it.
+- ``NPlusOneTestMixin`` adds ``assertNoNPlusOne`` and
+  ``assertQueriesDoNotGrow`` to a TestCase.
+"""
+import contextvars
+import logging
+import re
+import sys
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .instrumentation import add_query_listener, fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD': 5,
+    'RAISE': False,
+}
+
+PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+# Frames in this package (middleware, instrumentation) are never the cause
+PACKAGE_DIR = str(Path(__file__).resolve().parent)
+IGNORED_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+# bulk_create splits large inserts into batches of many rows each; those repeat by design
+BATCH_INSERT = re.compile(r'\bVALUES\s*\([^()]*\)\s*,\s*\(', re.IGNORECASE)
+
+_current = contextvars.ContextVar('nplusone_recorder', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'NPLUSONE', {})}
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+class Finding:
+    def __init__(self, fingerprint, count, field, location):
+        self.fingerprint = fingerprint
+        self.count = count
+        self.field = field
+        self.location = location
+
+    def __str__(self):
+        source = ', '.join(part for part in (self.field, self.location) if part) or 'unknown'
+        return f'{self.count}x from {source}: {self.fingerprint}'
+
+
+def _source(frame):
+    """The serializer field being rendered and the first project frame below ``frame``."""
+    field = location = None
+    while frame is not None and not (field and location):
+        filename = frame.f_code.co_filename
+        if field is None and filename.endswith('rest_framework/serializers.py') and frame.f_code.co_name == 'to_representation':
+            serializer_field = frame.f_locals.get('field')
+            if serializer_field is not None and serializer_field.parent is not None:
+                field = f'{type(serializer_field.parent).__name__}.{serializer_field.field_name}'
+        if (location is None and filename.startswith(PROJECT_ROOT) and not filename.startswith(PACKAGE_DIR)
+                and 'site-packages' not in filename):
+            location = f'{Path(filename).relative_to(PROJECT_ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return field, location
+
+
+class QueryRecorder:
+    """Counts the queries run while active by fingerprint, noting where the repeated ones come from."""
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold or get_config()['THRESHOLD']
+        self.total = 0
+        self.counts = Counter()
+        self.sources = {}
+
+    def record(self, sql):
+        if sql.lstrip().upper().startswith(IGNORED_STATEMENTS) or BATCH_INSERT.search(sql):
+            return
+        shape = fingerprint(sql)
+        self.total += 1
+        self.counts[shape] += 1
+        # Walking the stack is slow, so only do it once a shape repeats
+        if self.counts[shape] == min(self.threshold, 2):
+            self.sources[shape] = _source(sys._getframe(1))
+
+    def findings(self):
+        return [
+            Finding(shape, count, *self.sources.get(shape, (None, None)))
+            for shape, count in self.counts.most_common() if count >= self.threshold
+        ]
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        add_query_listener(_record_query)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+
+
+def _record_query(sql, elapsed):
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.record(sql)
+
+
+def report(label, findings):
+    return f'N+1 queries in {label}:' + ''.join(f'\n  {finding}' for finding in findings)
+
+
+class NPlusOneMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = config['THRESHOLD']
+        self.raise_errors = config['RAISE']
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with QueryRecorder(self.threshold) as recorder:
+            response = self.get_response(request)
+        self.check(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        with QueryRecorder(self.threshold) as recorder:
+            response = await self.get_response(request)
+        self.check(request, recorder)
+        return response
+
+    def check(self, request, recorder):
+        findings = recorder.findings()
+        if findings:
+            message = report(f'{request.method} {request.path}', findings)
+            if self.raise_errors:
+                raise NPlusOneError(message)
+            logger.warning(message)
+
+
+class NPlusOneTestMixin:
+    @contextmanager
+    def assertNoNPlusOne(self, threshold=None):
+        with QueryRecorder(threshold) as recorder:
+            yield recorder
+        findings = recorder.findings()
+        if findings:
+            self.fail(report('block', findings))
+
+    def assertQueriesDoNotGrow(self, request, add_rows):
+        """
+        Run ``request``, call ``add_rows`` to enlarge its result, and run it again: it must
+        not issue more queries the second time.
+        """
+        with QueryRecorder() as before:
+            request()
+        add_rows()
+        with QueryRecorder(threshold=2) as after:
+            request()
+        if after.total > before.total:
+            grown = [finding for finding in after.findings() if finding.count > before.counts[finding.fingerprint]]
+            self.fail(f'{before.total} queries grew to {after.total} with more rows.\n' + report('request', grown))
@@ -48,11 +48,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'task_management.instrumentation.InstrumentationMiddleware',
+    'task_management.nplusone.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'task_management.db_router.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -84,7 +87,56 @@ WSGI_APPLICATION = 'task_management.wsgi.application'
 
 
 
-DATABASES = {'default' : dj_database_url.config(conn_max_age=600, ssl_require=True)}
+# psycopg connection pool of each process for PostgreSQL databases: MIN_SIZE connections are kept open, up to
+# MAX_SIZE are opened under load, and requests wait TIMEOUT seconds for one before failing. Pooled connections are
+# checked before use and replaced after MAX_LIFETIME seconds, so connections broken by a failover are not handed out.
+# DATABASE_POOL_MAX_SIZE=0 turns the pool off for persistent per-thread connections (CONN_MAX_AGE) instead.
+DATABASE_POOL = {
+    'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+    'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+    'timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+    'max_lifetime': float(os.environ.get('DATABASE_POOL_MAX_LIFETIME', 1800)),
+    'max_idle': 300,
+}
+
+
+def database(url):
+    config = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True, ssl_require=not url.startswith('sqlite'))
+    if config['ENGINE'] == 'django.db.backends.postgresql' and DATABASE_POOL['max_size']:
+        # The pool owns connections, which Django returns to it at the end of every request
+        config['CONN_MAX_AGE'] = 0
+        config['OPTIONS']['pool'] = {**DATABASE_POOL, 'min_size': min(DATABASE_POOL['min_size'], DATABASE_POOL['max_size'])}
+    return config
+
+
+DATABASES = {'default': database(os.environ['DATABASE_URL']) if os.environ.get('DATABASE_URL') else {}}
+
+# Read replicas for GET requests (see task_management/db_router.py), as a comma-separated list of database URLs.
+# In tests a replica is the default database.
+DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    DATABASE_REPLICAS.append(f'replica_{number}')
+    DATABASES[f'replica_{number}'] = {**database(url.strip()), 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['task_management.db_router.ReplicaRouter']
+# Seconds a user reads from the primary after a write, to cover replication lag
+DATABASE_REPLICA_PIN_SECONDS = 10
+# Seconds an unreachable replica is left out before it is tried again
+DATABASE_REPLICA_RETRY_SECONDS = 30
+
+# Cached task stats (and their per-user versions) must be shared by every process, so use Redis when it is configured
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -132,11 +184,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    # Opt-in: list endpoints only paginate when the client sends ?page_size= or ?cursor=
+    'DEFAULT_PAGINATION_CLASS': 'tasks.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
 SIMPLE_JWT = {
@@ -147,4 +202,53 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
-AUTH_USER_MODEL = 'users.CustomUser'
\ No newline at end of file
+AUTH_USER_MODEL = 'users.CustomUser'
+
+# Authenticated users are cached by CachedJWTAuthentication to skip the user query on each request.
+# Use 'users.authentication.DjangoUserCache' to share the cache (and its invalidation) between processes.
+JWT_USER_CACHE = {
+    'BACKEND': 'users.authentication.LocalMemoryUserCache',
+    'TIMEOUT': 60,
+    'MAX_SIZE': 10000,
+    'CACHE_ALIAS': 'default',
+}
+
+# Task notifications are queued and bulk-inserted by a background thread (see tasks/notifications.py)
+TASK_NOTIFICATIONS = {
+    'BACKEND': 'tasks.notifications.DatabaseBackend',
+    'ASYNC': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 0.5,
+    'MERGE_WINDOW': 5,
+}
+
+# Seconds the stats of a user are cached for; writes to their tasks invalidate them sooner
+TASK_STATS_CACHE_TIMEOUT = 300
+
+# Seconds task list and detail responses are cached for (see tasks/response_cache.py); 0 turns the cache off
+TASK_RESPONSE_CACHE_TIMEOUT = 300
+
+# Days /api/tasks/changes/ tokens stay valid; prune_task_changes deletes older change log rows
+TASK_CHANGES_RETENTION_DAYS = 30
+
+# Per-view latency, query and serialization metrics on /metrics (see task_management/instrumentation.py).
+# Set METRICS_TOKEN to require "Authorization: Bearer <token>" from the scraper.
+INSTRUMENTATION = {
+    'SLOW_REQUEST_MS': 1000,
+    'SQL_SAMPLE_RATE': 0.01,
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+# Reports queries repeated THRESHOLD times in one request (see task_management/nplusone.py). On with DEBUG;
+# NPLUSONE_RAISE=1 also turns it on and makes such requests fail, e.g. for the test suite.
+NPLUSONE = {
+    'ENABLED': DEBUG or os.environ.get('NPLUSONE_RAISE') == '1',
+    'THRESHOLD': 5,
+    'RAISE': os.environ.get('NPLUSONE_RAISE') == '1',
+}
+
+# Delivers new notifications to /api/notifications/stream/ connections held by this process
+NOTIFICATION_BROKER = 'tasks.streaming.InProcessBroker'
+
+# Days before its due date that run_scheduler reminds about a task
+TASK_REMINDER_LEAD_DAYS = 1
\ No newline at end of file
@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def install_search_triggers(sender, using, **kwargs):
+    # SQLite drops the full-text triggers whenever a migration rebuilds tasks_task
+    from .search import install_triggers
+    install_triggers(connections[using])
 
 
 class TasksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tasks'
+
+    def ready(self):
+        # Connects the signal receivers (notification counters, the stream broker and the share change log)
+        from . import changes, streaming  # noqa: F401
+        post_migrate.connect(install_search_triggers, sender=self)
@@ -0,0 +1,144 @@
+"""Helpers shared by the ``benchmark_*`` management commands."""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.utils import timezone
+
+from . import recurrence
+from .models import Task, Category, TaskHistory, TaskOccurrence, Notification, SharedTask
+
+User = get_user_model()
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    # Benchmarks seed a lot of rows, so always run them against a throwaway test database
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def analyze():
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def _insert(model, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def seed(users=10, tasks_per_user=1000, categories_per_user=5, share_ratio=0.1, history_ratio=0.2,
+         notifications_per_user=100, unread_ratio=0.2, batch_size=5000, random_seed=0, vocabulary=None,
+         recurring_ratio=0, password=None):
+    """
+    Bulk-insert a synthetic dataset and return the created users.
+
+    ``share_ratio`` of the tasks are shared with one other user and
+    ``history_ratio`` of them get a completion in TaskHistory. With a
+    ``vocabulary``, titles and descriptions are random words from it.
+    ``recurring_ratio`` of the tasks recur, with their occurrences
+    materialized. Users can only log in if given a ``password``.
+    """
+    rng = random.Random(random_seed)
+    today = timezone.localdate()
+    now = timezone.now()
+    password = make_password(password)
+    rules = list(recurrence.RULES)
+    offset = User.objects.count()
+
+    User.objects.bulk_create([
+        User(username=f'bench{offset + i}', email=f'bench{offset + i}@example.com', password=password)
+        for i in range(users)
+    ])
+    created_users = list(User.objects.filter(username__startswith='bench').order_by('-id')[:users])[::-1]
+    user_ids = [user.id for user in created_users]
+
+    Category.objects.bulk_create([
+        Category(name=f'Category {i}', user_id=user_id)
+        for user_id in user_ids for i in range(categories_per_user)
+    ])
+    categories = {}
+    for category_id, user_id in Category.objects.filter(user_id__in=user_ids).values_list('id', 'user_id'):
+        categories.setdefault(user_id, []).append(category_id)
+
+    statuses = [choice for choice, _ in Task.STATUS_CHOICES]
+    priorities = [choice for choice, _ in Task.PRIORITY_CHOICES]
+    _insert(Task, (
+        Task(
+            title=' '.join(rng.choices(vocabulary, k=3)) if vocabulary else f'Task {i}',
+            description=' '.join(rng.choices(vocabulary, k=12)) if vocabulary else 'Synthetic benchmark task',
+            due_date=today + timedelta(days=rng.randint(-365, 365)),
+            priority=rng.choice(priorities),
+            status=rng.choice(statuses),
+            user_id=user_id,
+            category_id=rng.choice(categories[user_id]) if categories.get(user_id) else None,
+            recurrence=rng.choice(rules) if recurring_ratio and rng.random() < recurring_ratio else 'None',
+        )
+        for user_id in user_ids for i in range(tasks_per_user)
+    ), batch_size)
+
+    task_rows = Task.objects.filter(user_id__in=user_ids).values_list('id', 'user_id')
+    if recurring_ratio:
+        recurring = Task.objects.filter(user_id__in=user_ids, recurrence__in=rules).only(
+            'id', 'user_id', 'due_date', 'next_due_date', 'recurrence', 'status'
+        )
+        batch = []
+        for task in recurring.iterator(chunk_size=batch_size):
+            batch.append(task)
+            if len(batch) >= batch_size:
+                TaskOccurrence.objects.sync(batch)
+                batch = []
+        TaskOccurrence.objects.sync(batch)
+    if len(user_ids) > 1 and share_ratio:
+        _insert(SharedTask, (
+            SharedTask(task_id=task_id, shared_with_id=rng.choice([uid for uid in user_ids if uid != user_id]))
+            for task_id, user_id in task_rows.iterator(chunk_size=batch_size)
+            if rng.random() < share_ratio
+        ), batch_size)
+    if history_ratio:
+        _insert(TaskHistory, (
+            TaskHistory(task_id=task_id, user_id=user_id, completed_at=now - timedelta(minutes=rng.randint(0, 525600)))
+            for task_id, user_id in task_rows.iterator(chunk_size=batch_size)
+            if rng.random() < history_ratio
+        ), batch_size)
+    if notifications_per_user:
+        tasks_by_user = {}
+        for task_id, user_id in task_rows.iterator(chunk_size=batch_size):
+            tasks_by_user.setdefault(user_id, []).append(task_id)
+        _insert(Notification, (
+            Notification(
+                user_id=user_id,
+                task_id=rng.choice(tasks_by_user[user_id]),
+                message='Synthetic benchmark notification',
+                is_read=rng.random() >= unread_ratio,
+            )
+            for user_id in user_ids if tasks_by_user.get(user_id)
+            for _ in range(notifications_per_user)
+        ), batch_size)
+    return created_users
+
+
+def timed(func, repeat=5):
+    """Call ``func`` ``repeat`` times and return the median and best wall time in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), min(samples)
@@ -0,0 +1,173 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Task, Category, TaskHistory, TaskOccurrence, SharedTask
+from .changes import tasks_changed
+from .notifications import create_task_notifications, recount_unread, notification_users
+from .serializers import TaskSerializer
+
+MAX_OPERATIONS = 10000
+OPERATIONS = ('create', 'update', 'complete', 'delete')
+UPDATE_FIELDS = ['title', 'description', 'due_date', 'priority', 'status', 'completed_at', 'category',
+                 'recurrence', 'next_due_date', 'updated_at']
+
+
+class BulkTaskOperations:
+    """
+    Validates a list of ``{"op": ..., "id": ..., "data": {...}}`` operations up front
+    and, when all of them are valid, applies them in a single transaction with
+    ``bulk_create``/``bulk_update``. Nothing is written if any operation is invalid.
+    """
+
+    def __init__(self, user, operations, context):
+        self.user = user
+        self.operations = operations
+        self.context = context
+        self.results = []
+
+    def run(self):
+        if not isinstance(self.operations, list):
+            return {'non_field_errors': ['Expected a list of operations.']}, False
+        if len(self.operations) > MAX_OPERATIONS:
+            return {'non_field_errors': [f'At most {MAX_OPERATIONS} operations are allowed per request.']}, False
+
+        self.results = [{'index': index} for index in range(len(self.operations))]
+        by_op = self.check_operations()
+        self.load(by_op)
+        creates = self.validate_creates(by_op['create'])
+        updates = self.validate_updates(by_op['update'])
+        completes = self.check_targets(by_op['complete'], edit=False)
+        deletes = self.check_targets(by_op['delete'], edit=True)
+        if any('errors' in result for result in self.results):
+            for result in self.results:
+                result['status'] = 'error' if 'errors' in result else 'skipped'
+            return self.results, False
+
+        with transaction.atomic():
+            self.apply(creates, updates, completes, deletes)
+        return self.results, True
+
+    def check_operations(self):
+        by_op = {op: [] for op in OPERATIONS}
+        seen_ids = set()
+        for index, operation in enumerate(self.operations):
+            result = self.results[index]
+            if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+                result['errors'] = {'op': [f'Expected one of: {", ".join(OPERATIONS)}.']}
+                continue
+            result['op'] = op = operation['op']
+            if op in ('create', 'update') and not isinstance(operation.get('data'), dict):
+                result['errors'] = {'data': ['This field is required.']}
+                continue
+            if op != 'create':
+                try:
+                    task_id = int(operation.get('id'))
+                except (TypeError, ValueError):
+                    result['errors'] = {'id': ['A valid task id is required.']}
+                    continue
+                result['id'] = task_id
+                if task_id in seen_ids:
+                    result['errors'] = {'id': ['Task appears in more than one operation.']}
+                    continue
+                seen_ids.add(task_id)
+            by_op[op].append((index, operation))
+        return by_op
+
+    def load(self, by_op):
+        task_ids = [self.results[index]['id'] for op in ('update', 'complete', 'delete') for index, _ in by_op[op]]
+        self.tasks = Task.objects.visible_to(self.user).in_bulk(task_ids)
+        self.editable = {
+            task_id for task_id, task in self.tasks.items() if task.user_id == self.user.pk
+        } | set(
+            SharedTask.objects.filter(task_id__in=task_ids, shared_with=self.user, can_edit=True)
+            .values_list('task_id', flat=True)
+        )
+
+        category_ids = set()
+        for op in ('create', 'update'):
+            for _, operation in by_op[op]:
+                try:
+                    category_ids.add(int(operation['data']['category_id']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+        self.context = {
+            **self.context,
+            'categories': Category.objects.in_bulk(category_ids),
+            'instances': self.tasks,
+        }
+
+    def validate_creates(self, items):
+        if not items:
+            return []
+        serializer = TaskSerializer(data=[operation['data'] for _, operation in items], many=True, context=self.context)
+        if serializer.is_valid():
+            return [(index, data) for (index, _), data in zip(items, serializer.validated_data)]
+        for (index, _), errors in zip(items, serializer.errors):
+            if errors:
+                self.results[index]['errors'] = errors
+        return []
+
+    def validate_updates(self, items):
+        items = self.check_targets(items, edit=True)
+        if not items:
+            return []
+        data = [{**operation['data'], 'id': self.results[index]['id']} for index, operation in items]
+        serializer = TaskSerializer(data=data, many=True, partial=True, context=self.context)
+        if serializer.is_valid():
+            return [(index, data) for (index, _), data in zip(items, serializer.validated_data)]
+        for (index, _), errors in zip(items, serializer.errors):
+            if errors:
+                self.results[index]['errors'] = errors
+        return []
+
+    def check_targets(self, items, edit):
+        valid = []
+        for index, operation in items:
+            task_id = self.results[index]['id']
+            if task_id not in self.tasks:
+                self.results[index]['errors'] = {'id': ['Task not found.']}
+            elif edit and task_id not in self.editable:
+                self.results[index]['errors'] = {'id': ["You don't have permission to edit this task."]}
+            else:
+                valid.append((index, operation))
+        return valid
+
+    def apply(self, creates, updates, completes, deletes):
+        now = timezone.now()
+
+        created = Task.objects.bulk_create([Task(user=self.user, **data) for _, data in creates])
+        for (index, _), task in zip(creates, created):
+            self.results[index].update(id=task.pk, status='ok')
+
+        changed = {}
+        for index, data in updates:
+            task = self.tasks[self.results[index]['id']]
+            task.apply_changes(data, now)
+            changed[task.pk] = task
+            self.results[index]['status'] = 'ok'
+
+        history = []
+        for index, _ in completes:
+            task = self.tasks[self.results[index]['id']]
+            task.complete(now)
+            history.append(TaskHistory(task=task, completed_at=now, user=self.user))
+            changed[task.pk] = task
+            self.results[index]['status'] = 'ok'
+
+        # bulk_update doesn't apply auto_now
+        for task in changed.values():
+            task.updated_at = now
+        Task.objects.bulk_update(changed.values(), UPDATE_FIELDS, batch_size=500)
+        TaskHistory.objects.bulk_create(history)
+        TaskOccurrence.objects.sync([*created, *changed.values()])
+
+        delete_ids = [self.results[index]['id'] for index, _ in deletes]
+        notified_users = notification_users(delete_ids)
+        tasks_changed([*created, *changed.values(), *(self.tasks[task_id] for task_id in delete_ids)])
+        Task.objects.filter(pk__in=delete_ids).delete()
+        recount_unread(notified_users)
+        for index, _ in deletes:
+            self.results[index]['status'] = 'ok'
+
+        create_task_notifications([(self.user, task) for task in created], 'created')
+        create_task_notifications([(self.user, self.tasks[self.results[index]['id']]) for index, _ in updates], 'updated')
@@ -0,0 +1,37 @@
+"""
+Per-user versions of task and notification data.
+
+Anything cached or ETagged from a user's tasks is keyed by their current
+version, so a new version invalidates all of it at once without tracking
+keys. Versions are read from the database, which every process (web
+workers and run_scheduler alike) shares, rather than kept in a cache that
+may be local to one process:
+
+- tasks: the id of the user's latest TaskChange. Every write to a task logs
+  one for its owner and everyone it is shared with (see tasks.changes).
+- notifications: the version of the user's NotificationCounter, which every
+  write to their notifications increments (see tasks.notifications).
+
+Read the version before the data it covers, so data cached under a version
+is never older than it.
+"""
+from .models import NotificationCounter, TaskChange
+
+TASKS = 'tasks'
+NOTIFICATIONS = 'notifications'
+
+
+def get_version(user_id, scope=TASKS):
+    if scope == NOTIFICATIONS:
+        versions = NotificationCounter.objects.filter(user_id=user_id).values_list('version', flat=True)
+    else:
+        versions = TaskChange.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True)
+    return versions.first() or 0
+
+
+def request_version(request, scope=TASKS):
+    """The version of ``request.user``, read once per request however many caches are keyed on it."""
+    versions = request.__dict__.setdefault('_data_versions', {})
+    if scope not in versions:
+        versions[scope] = get_version(request.user.pk, scope)
+    return versions[scope]
@@ -0,0 +1,99 @@
+"""
+Change log for delta sync.
+
+Every write to a task logs a TaskChange row for each user who can see it
+(the owner and the users it is shared with), which also moves on their
+version of task data (see tasks.cache). ``/api/tasks/changes/?since=<token>`` reads the log. It returns
+the current state of every task logged since the token, and lists the ones
+the user can no longer see (deleted or unshared) as deleted. So the log only
+needs task ids, not what changed.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Max, QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import SharedTask, Task, TaskChange
+
+
+def tasks_changed(tasks):
+    """Log a change of ``tasks`` for everyone who can see them. Call it before deleting them."""
+    tasks = list(tasks)
+    if not tasks:
+        return
+    shares = SharedTask.objects.filter(task__in=[task.pk for task in tasks]).values_list('task_id', 'shared_with_id')
+    rows = {(task.user_id, task.pk) for task in tasks} | {(user_id, task_id) for task_id, user_id in shares}
+    log_changes(rows)
+
+
+def log_changes(rows):
+    """Log ``(user_id, task_id)`` pairs."""
+    TaskChange.objects.bulk_create([TaskChange(user_id=user_id, task_id=task_id) for user_id, task_id in rows])
+
+
+@receiver(post_save, sender=SharedTask)
+def _share_saved(sender, instance, **kwargs):
+    # The sharee gains the task and the owner's copy lists a different set of users
+    log_changes({(instance.shared_with_id, instance.task_id), (instance.task.user_id, instance.task_id)})
+
+
+@receiver(post_delete, sender=SharedTask)
+def _share_deleted(sender, instance, origin=None, **kwargs):
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is Task:
+        # The shares of deleted tasks; whoever deletes tasks logs them with tasks_changed first
+        return
+    if origin_model is get_user_model():
+        # Logged once per deletion by _users_deleted, when it is known which users are gone
+        origin.__dict__.setdefault('_deleted_shares', []).append((instance.task_id, instance.shared_with_id))
+        return
+    log_share_changes([(instance.task_id, instance.shared_with_id)])
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _users_deleted(sender, instance, origin=None, **kwargs):
+    # Sent after the shares of the deleted users are gone. The users on the other side of those
+    # shares lose a task or a sharee; the deleted users themselves get nothing logged.
+    shares = origin.__dict__.pop('_deleted_shares', None) if origin is not None else None
+    if shares:
+        sharees = {user_id for _, user_id in shares}
+        deleted = sharees - set(get_user_model().objects.filter(pk__in=sharees).values_list('pk', flat=True))
+        log_share_changes(shares, deleted)
+
+
+def log_share_changes(shares, deleted_users=()):
+    """Log removed ``(task_id, shared_with_id)`` shares for the sharees and the owners of the remaining tasks."""
+    owners = Task.objects.filter(pk__in={task_id for task_id, _ in shares}).values_list('pk', 'user_id')
+    log_changes(
+        {(user_id, task_id) for task_id, user_id in shares if user_id not in deleted_users}
+        | {(user_id, task_id) for task_id, user_id in owners}
+    )
+
+
+def retention():
+    return timedelta(days=getattr(settings, 'TASK_CHANGES_RETENTION_DAYS', 30))
+
+
+def encode_token(change_id, issued_at=None):
+    issued_at = issued_at or timezone.now()
+    return f'{change_id}.{int(issued_at.timestamp())}'
+
+
+def decode_token(token):
+    """Return ``(change_id, issued_at)``; raises ValueError for tokens not issued by this API."""
+    change_id, issued_at = token.split('.')
+    return int(change_id), datetime.fromtimestamp(int(issued_at), tz=dt_timezone.utc)
+
+
+def prune(now=None):
+    """
+    Delete changes older than the retention period. Tokens older than that get a 410. Each
+    user's latest change is kept, as it is their version of task data.
+    """
+    cutoff = (now or timezone.now()) - retention()
+    latest = TaskChange.objects.values('user_id').annotate(latest=Max('id')).values('latest')
+    return TaskChange.objects.filter(created_at__lt=cutoff).exclude(pk__in=latest).delete()[0]
@@ -0,0 +1,45 @@
+import hashlib
+
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import TASKS, request_version
+
+
+class ConditionalGetMixin:
+    """
+    Weak ETags for ``list`` and ``retrieve`` built from the user's version in
+    ``etag_scope`` (see tasks.cache), so a client whose copy is current gets a
+    304 without the queryset being evaluated or serialized.
+    """
+    etag_scope = TASKS
+
+    def get_etag(self, request):
+        # The version covers every write; the URL and media type tell apart the representations of one version
+        representation = f'{request.user.pk}|{request.get_full_path()}|{request.accepted_media_type}'
+        digest = hashlib.sha1(representation.encode()).hexdigest()[:16]
+        return f'W/"{request_version(request, self.etag_scope)}-{digest}"'
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        # If-None-Match uses the weak comparison, so W/ prefixes are ignored on both sides
+        if_none_match = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag.removeprefix('W/') in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+            # * matches any current representation, so it needs the handler to find one first
+            if '*' in if_none_match and response.status_code == status.HTTP_200_OK:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
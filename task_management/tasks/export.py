@@ -0,0 +1,114 @@
+"""
+Streaming CSV and NDJSON exports.
+
+Rows are read with ``values_list().iterator()`` so no model instances are
+built and only one chunk of rows is held at a time. Under ASGI the response
+gets an async iterator that pulls one chunk per ``sync_to_async`` call;
+Django would otherwise buffer a synchronous iterator into a list first.
+"""
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+CHUNK_SIZE = 2000
+
+TASK_COLUMNS = {
+    'id': 'id',
+    'title': 'title',
+    'description': 'description',
+    'due_date': 'due_date',
+    'next_due_date': 'next_due_date',
+    'priority': 'priority',
+    'status': 'status',
+    'completed_at': 'completed_at',
+    'recurrence': 'recurrence',
+    'updated_at': 'updated_at',
+    'category_id': 'category_id',
+    'category_name': 'category__name',
+    'user': 'user_id',
+}
+
+HISTORY_COLUMNS = {
+    'id': 'id',
+    'task': 'task_id',
+    'title': 'task__title',
+    'completed_at': 'completed_at',
+    'user': 'user__username',
+}
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only error responses go through here; exports stream their own body
+        rows = data if isinstance(data, list) else [data or {}]
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode()
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows).encode()
+
+
+def csv_chunks(rows, columns, chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, columns, chunk_size=CHUNK_SIZE):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder))
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+FORMATS = {
+    'csv': csv_chunks,
+    'ndjson': ndjson_chunks,
+}
+
+
+async def _async_chunks(chunks):
+    next_chunk = sync_to_async(lambda: next(chunks, None))
+    while (chunk := await next_chunk()) is not None:
+        yield chunk
+
+
+def export_response(request, queryset, columns, filename):
+    """Stream ``queryset`` as the negotiated format, one ``columns`` row per object."""
+    renderer = request.accepted_renderer
+    rows = queryset.values_list(*columns.values()).iterator(chunk_size=CHUNK_SIZE)
+    chunks = FORMATS[renderer.format](rows, list(columns))
+    if isinstance(request._request, ASGIRequest):
+        chunks = _async_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=f'{renderer.media_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{renderer.format}"'
+    return response
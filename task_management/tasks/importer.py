@@ -0,0 +1,182 @@
+"""
+Bulk task import.
+
+Uploads are parsed as a stream (CSV, NDJSON or a JSON array) and validated
+row by row with one reusable serializer. Categories are resolved by name
+from an in-memory table, missing ones are created per batch, and tasks are
+inserted with ``bulk_create``, one transaction per batch. Invalid rows are
+skipped and reported; imports don't send per-task notifications.
+"""
+import csv
+import io
+import json
+import os
+
+from django.db import transaction
+from rest_framework import serializers
+
+from .changes import log_changes
+from .models import Task, Category, TaskOccurrence
+from .serializers import TaskImportSerializer
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+READ_SIZE = 64 * 1024
+FORMATS = ('csv', 'ndjson', 'json')
+
+
+def parse_csv(text):
+    return csv.DictReader(text)
+
+
+class InvalidRow:
+    """A row the parser could not read; it is reported under its number and the import goes on."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def parse_ndjson(text):
+    # Blank lines yield None so that row numbers stay line numbers
+    for line in text:
+        if not line.strip():
+            yield None
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            yield InvalidRow(f'Invalid JSON: {exc}')
+
+
+def parse_json(text):
+    """Yield the items of a top-level JSON array without reading the whole document."""
+    decoder = json.JSONDecoder()
+    buffer, pos, started, eof = '', 0, False, False
+    while not eof:
+        chunk = text.read(READ_SIZE)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ',')):
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('Expected a JSON array.')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break
+            if end == len(buffer) and not eof:
+                # A number or literal may continue in the next chunk
+                break
+            yield item
+            pos = end
+    raise ValueError('Unterminated JSON array.')
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ndjson': parse_ndjson,
+    'json': parse_json,
+}
+
+
+def detect_format(filename, content_type=''):
+    extension = os.path.splitext(filename or '')[1].lstrip('.').lower()
+    if extension in FORMATS:
+        return extension
+    if extension == 'jsonl' or 'ndjson' in content_type:
+        return 'ndjson'
+    if 'csv' in content_type:
+        return 'csv'
+    if 'json' in content_type:
+        return 'json'
+    return None
+
+
+def open_upload(upload):
+    return io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+
+
+class TaskImporter:
+    def __init__(self, user, batch_size=BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.serializer = TaskImportSerializer()
+        self.categories = {}
+        for category_id, name in Category.objects.filter(user=user).order_by('-id').values_list('id', 'name'):
+            # The oldest category wins when names are duplicated
+            self.categories[name] = category_id
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        """Import ``rows`` (an iterable of dicts) and return a summary with per-row errors."""
+        batch = []
+        try:
+            for number, row in enumerate(rows, 1):
+                if row is None:
+                    continue
+                data = self.validate(number, row)
+                if data is not None:
+                    batch.append(data)
+                if len(batch) >= self.batch_size:
+                    self.insert(batch)
+                    batch = []
+        except (ValueError, csv.Error) as exc:
+            # The file itself is broken; keep what was imported before that point
+            self.failed += 1
+            self.add_error(None, {'non_field_errors': [f'Could not parse the file: {exc}']})
+        if batch:
+            self.insert(batch)
+        return {'created': self.created, 'failed': self.failed, 'errors': self.errors}
+
+    def validate(self, number, row):
+        if isinstance(row, InvalidRow):
+            self.failed += 1
+            self.add_error(number, {'non_field_errors': [row.message]})
+            return None
+        if not isinstance(row, dict):
+            self.failed += 1
+            self.add_error(number, {'non_field_errors': ['Expected an object.']})
+            return None
+        try:
+            # Empty CSV cells count as missing, so optional columns fall back to their defaults
+            return self.serializer.run_validation({key: value for key, value in row.items() if value != ''})
+        except serializers.ValidationError as exc:
+            self.failed += 1
+            self.add_error(number, exc.detail)
+            return None
+
+    def add_error(self, number, errors):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def insert(self, batch):
+        with transaction.atomic():
+            missing = {data['category'] for data in batch if data.get('category')} - set(self.categories)
+            for category in Category.objects.bulk_create([Category(user=self.user, name=name) for name in missing]):
+                self.categories[category.name] = category.pk
+            tasks = Task.objects.bulk_create([
+                Task(
+                    user=self.user,
+                    category_id=self.categories.get(data.pop('category', None) or None),
+                    **data,
+                )
+                for data in batch
+            ])
+            TaskOccurrence.objects.sync([task for task in tasks if task.recurrence != 'None'])
+            # New tasks aren't shared with anyone yet
+            log_changes({(self.user.pk, task.pk) for task in tasks})
+        self.created += len(tasks)
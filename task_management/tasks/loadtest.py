@@ -0,0 +1,205 @@
+"""
+Scenario benchmarks for the task, notification and history endpoints.
+
+``benchmark_api`` seeds a throwaway database, then sends every scenario
+through the full middleware stack with ``django.test.Client`` and a JWT, as
+one user of the seeded set. Each request is timed and its queries counted;
+notifications are written inline rather than by the background dispatcher,
+so their queries count towards the request that caused them. The response
+cache is off, so that list and detail scenarios measure their queries and
+serialization; ``tasks.list.cached`` measures the cache on its own.
+Results are plain dicts, saved as JSON and compared between runs with
+``compare``.
+"""
+import io
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+import django
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Notification, Task
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Context:
+    """What scenarios need to address the seeded rows of the benchmarked user."""
+
+    def __init__(self, user):
+        self.user = user
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+        # Pending one-off tasks, which mark_complete and mark_incomplete flip back and forth
+        self.task_ids = list(
+            Task.objects.filter(user=user, status='Pending', recurrence='None').order_by('id').values_list('id', flat=True)
+        )
+        self.notification_ids = list(Notification.objects.filter(user=user).order_by('id').values_list('id', flat=True))
+        self.category_id = user.categories.values_list('id', flat=True).first()
+        self.created = []
+        self.etag = None
+
+    def task(self, i):
+        return self.task_ids[i % len(self.task_ids)]
+
+    def notification(self, i):
+        return self.notification_ids[i % len(self.notification_ids)]
+
+
+def _get(path):
+    return lambda client, ctx, i: client.get(path, **ctx.headers)
+
+
+def _create(client, ctx, i):
+    response = client.post('/api/tasks/', {
+        'title': f'Load test {i}', 'description': 'Created by benchmark_api', 'priority': 'Medium',
+        'due_date': str(timezone.localdate()), 'category_id': ctx.category_id,
+    }, content_type='application/json', **ctx.headers)
+    if response.status_code == 201:
+        ctx.created.append(response.json()['id'])
+    return response
+
+
+def _delete(client, ctx, i):
+    return client.delete(f'/api/tasks/{ctx.created.pop()}/', **ctx.headers)
+
+
+def _not_modified(client, ctx, i):
+    if ctx.etag is None:
+        ctx.etag = client.get('/api/tasks/?page_size=100', **ctx.headers)['ETag']
+    return client.get('/api/tasks/?page_size=100', HTTP_IF_NONE_MATCH=ctx.etag, **ctx.headers)
+
+
+def _cached(path):
+    def request(client, ctx, i):
+        with override_settings(TASK_RESPONSE_CACHE_TIMEOUT=300):
+            return client.get(path, **ctx.headers)
+    return request
+
+
+def _import(client, ctx, i):
+    upload = io.BytesIO(b'title,description,due_date,priority\n' + b''.join(
+        f'Imported {i}.{n},Load test,{timezone.localdate()},Low\n'.encode() for n in range(10)
+    ))
+    upload.name = 'tasks.csv'
+    return client.post('/api/tasks/import/', {'file': upload}, **ctx.headers)
+
+
+# (name, request) pairs, run in this order: writes that need rows from an earlier scenario come after it
+SCENARIOS = [
+    ('tasks.list', _get('/api/tasks/?page_size=100')),
+    ('tasks.list.filtered', _get('/api/tasks/?page_size=100&status=Pending&priority=High&ordering=-due_date')),
+    ('tasks.list.sparse', _get('/api/tasks/?page_size=100&fields=id,title,due_date,status')),
+    ('tasks.list.search', _get('/api/tasks/?page_size=100&search=synthetic%20benchmark')),
+    ('tasks.list.not_modified', _not_modified),
+    ('tasks.list.cached', _cached('/api/tasks/?page_size=100')),
+    ('tasks.retrieve', lambda client, ctx, i: client.get(f'/api/tasks/{ctx.task(i)}/', **ctx.headers)),
+    ('tasks.stats', _get('/api/tasks/stats/')),
+    ('tasks.upcoming', _get('/api/tasks/upcoming/')),
+    ('tasks.changes', lambda client, ctx, i: client.get('/api/tasks/changes/?since=0.' + str(int(time.time())), **ctx.headers)),
+    ('tasks.export', _get('/api/tasks/export/?format=ndjson&status=Pending')),
+    ('tasks.create', _create),
+    ('tasks.update', lambda client, ctx, i: client.patch(
+        f'/api/tasks/{ctx.created[i % len(ctx.created)]}/', {'priority': 'High'}, content_type='application/json', **ctx.headers
+    )),
+    ('tasks.delete', _delete),
+    ('tasks.mark_complete', lambda client, ctx, i: client.patch(f'/api/tasks/{ctx.task(i)}/mark_complete/', **ctx.headers)),
+    ('tasks.mark_incomplete', lambda client, ctx, i: client.patch(f'/api/tasks/{ctx.task(i)}/mark_incomplete/', **ctx.headers)),
+    ('tasks.bulk', lambda client, ctx, i: client.post('/api/tasks/bulk/', [
+        {'op': 'update', 'id': ctx.task(i * 10 + n), 'data': {'priority': 'Low'}} for n in range(10)
+    ], content_type='application/json', **ctx.headers)),
+    ('tasks.import', _import),
+    ('history.list', _get('/api/task_history/?page_size=100')),
+    ('history.list.expanded', _get('/api/task_history/?page_size=100&expand=task')),
+    ('history.export', _get('/api/task_history/export/?format=csv')),
+    ('notifications.list', _get('/api/notifications/?page_size=100')),
+    ('notifications.retrieve', lambda client, ctx, i: client.get(f'/api/notifications/{ctx.notification(i)}/', **ctx.headers)),
+    ('notifications.unread', _get('/api/notifications/unread/?since=0')),
+    ('notifications.unread_count', _get('/api/notifications/unread/count/')),
+    ('notifications.mark_read', lambda client, ctx, i: client.patch(
+        '/api/notifications/mark_read/', {'notification_ids': [ctx.notification(i)]}, content_type='application/json', **ctx.headers
+    )),
+    ('notifications.mark_all_read', lambda client, ctx, i: client.post('/api/notifications/mark_all_read/', **ctx.headers)),
+]
+
+
+def summarize(latencies, queries, elapsed):
+    """Latency percentiles (ms), queries per request and requests per second of one scenario."""
+    ordered = sorted(latencies)
+    result = {'requests': len(ordered), 'mean_ms': statistics.fmean(ordered), 'max_ms': ordered[-1]}
+    for percentile in PERCENTILES:
+        result[f'p{percentile}_ms'] = ordered[min(len(ordered) - 1, len(ordered) * percentile // 100)]
+    result['queries_per_request'] = statistics.fmean(queries)
+    result['max_queries'] = max(queries)
+    result['requests_per_second'] = len(ordered) / elapsed
+    return result
+
+
+@override_settings(TASK_RESPONSE_CACHE_TIMEOUT=0)
+def run_scenario(request, ctx, requests, warmup=3):
+    client = Client()
+    for i in range(warmup):
+        request(client, ctx, i)
+    latencies, queries = [], []
+    started = time.perf_counter()
+    for i in range(warmup, warmup + requests):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = request(client, ctx, i)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            raise AssertionError(f'{response.status_code} {response.content[:200]!r}')
+        queries.append(len(captured))
+    return summarize(latencies, queries, time.perf_counter() - started)
+
+
+def metadata(**scale):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'scale': scale,
+    }
+
+
+def load(path):
+    with open(path) as results:
+        return json.load(results)
+
+
+def save(path, results):
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+
+def compare(baseline, current, threshold=0.2, min_delta_ms=1.0):
+    """
+    Return ``(rows, regressions)`` comparing the scenarios of two result sets. A scenario
+    regresses when it runs more queries per request, or when its p95 grows by more than
+    ``threshold`` and ``min_delta_ms``, so jitter on sub-millisecond requests is not one.
+    """
+    rows, regressions = [], []
+    for name, new in current['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        change = new['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0
+        rows.append((name, old['p95_ms'], new['p95_ms'], change, old['queries_per_request'], new['queries_per_request']))
+        slower = change > threshold and new['p95_ms'] - old['p95_ms'] > min_delta_ms
+        if slower or new['queries_per_request'] > old['queries_per_request'] + 0.01:
+            regressions.append(name)
+    return rows, regressions
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment
+
+from tasks.benchmark import analyze, benchmark_database, seed
+from tasks.loadtest import SCENARIOS, Context, compare, load, metadata, run_scenario, save
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every task, task history and notification endpoint on a seeded database: latency '
+            'percentiles, queries per request and throughput. Save results as JSON and compare them with a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--tasks-per-user', type=int, default=2000)
+        parser.add_argument('--notifications-per-user', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=100, help='Measured requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--scenario', action='append', help='Only run scenarios starting with this; repeatable.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='Compare with the results in this JSON file; fails on regressions.')
+        parser.add_argument('--threshold', type=float, default=0.2, help='p95 growth counted as a regression (0.2 = 20%%).')
+
+    def handle(self, *args, **options):
+        scenarios = [
+            (name, request) for name, request in SCENARIOS
+            if not options['scenario'] or name.startswith(tuple(options['scenario']))
+        ]
+        if not scenarios:
+            raise CommandError('No scenario matches --scenario.')
+        baseline = load(options['compare']) if options['compare'] else None
+        scale = {
+            'users': options['users'], 'tasks_per_user': options['tasks_per_user'],
+            'notifications_per_user': options['notifications_per_user'], 'requests': options['requests'],
+        }
+
+        setup_test_environment()
+        with benchmark_database(), override_settings(TASK_NOTIFICATIONS={'ASYNC': False}):
+            self.stdout.write('Seeding...')
+            user = seed(users=options['users'], tasks_per_user=options['tasks_per_user'], recurring_ratio=0.1,
+                        notifications_per_user=options['notifications_per_user'])[0]
+            analyze()
+            ctx = Context(user)
+            if len(ctx.task_ids) < options['warmup'] + options['requests']:
+                raise CommandError('Not enough pending tasks per user for --requests; raise --tasks-per-user.')
+
+            results = {'meta': metadata(**scale), 'scenarios': {}}
+            self.stdout.write(f"{'scenario':32} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} {'queries':>8}")
+            for name, request in scenarios:
+                try:
+                    result = run_scenario(request, ctx, options['requests'], options['warmup'])
+                except AssertionError as error:
+                    raise CommandError(f'{name} failed: {error}')
+                results['scenarios'][name] = result
+                self.stdout.write(
+                    f"{name:32} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} {result['p99_ms']:8.2f} "
+                    f"{result['requests_per_second']:8.0f} {result['queries_per_request']:8.1f}"
+                )
+
+        if options['output']:
+            save(options['output'], results)
+            self.stdout.write(f"Saved to {options['output']}")
+        if baseline is not None:
+            self.report(baseline, results, options['threshold'])
+
+    def report(self, baseline, results, threshold):
+        commit = (baseline['meta'].get('commit') or 'baseline')[:10]
+        self.stdout.write(f"\nAgainst {commit} ({baseline['meta'].get('database')}):")
+        rows, regressions = compare(baseline, results, threshold)
+        for name, old_p95, new_p95, change, old_queries, new_queries in rows:
+            self.stdout.write(
+                f'{name:32} p95 {old_p95:8.2f} -> {new_p95:8.2f} ms ({change:+.0%}), '
+                f'queries {old_queries:.1f} -> {new_queries:.1f}'
+            )
+        if regressions:
+            raise CommandError(f"Regressed: {', '.join(regressions)}")
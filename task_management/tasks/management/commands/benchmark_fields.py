@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from rest_framework_simplejwt.tokens import AccessToken
+
+from tasks.benchmark import analyze, benchmark_database, seed
+
+CASES = (
+    ('all fields', ''),
+    ('omit shared_with_users', 'omit=shared_with_users'),
+    ('id, title, due_date', 'fields=id,title,due_date'),
+    ('id, title, due_date, status, category', 'fields=id,title,due_date,status,category'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size, response time and queries of a large /api/tasks/ list with and without ?fields= / ?omit=.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # Every repeat after the first would be a response cache hit
+        with benchmark_database(), override_settings(TASK_RESPONSE_CACHE_TIMEOUT=0):
+            self.stdout.write('Seeding...')
+            user = seed(users=5, tasks_per_user=options['tasks'], share_ratio=0.2, history_ratio=0,
+                        notifications_per_user=0)[0]
+            analyze()
+            client = Client()
+            headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+            for label, query in CASES:
+                samples = []
+                for _ in range(options['repeat']):
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        response = client.get(f'/api/tasks/?{query}', **headers)
+                        samples.append((time.perf_counter() - start) * 1000)
+                    assert response.status_code == 200, response.status_code
+                samples.sort()
+                self.stdout.write(
+                    f'{label}: {len(response.content) / 1024:.0f} KiB, median {samples[len(samples) // 2]:.0f} ms, '
+                    f'best {samples[0]:.0f} ms, {len(queries)} queries'
+                )
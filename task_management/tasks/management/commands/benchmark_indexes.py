@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from tasks.benchmark import analyze, benchmark_database, seed, timed
+from tasks.models import Task, TaskHistory, Notification, SharedTask
+
+INDEXED_MODELS = [Task, Notification, SharedTask]
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and compare query plans and timings with and without the composite indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--tasks-per-user', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.stdout.write('Seeding...')
+            users = seed(
+                users=options['users'],
+                tasks_per_user=options['tasks_per_user'],
+                notifications_per_user=options['tasks_per_user'] // 2,
+            )
+            queries = self.get_queries(users[0], users[1])
+
+            self.drop_indexes()
+            analyze()
+            before = self.run(queries, options['repeat'])
+
+            self.create_indexes()
+            analyze()
+            after = self.run(queries, options['repeat'])
+
+        for name in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, results in (('before', before), ('after', after)):
+                plan, median, best = results[name]
+                self.stdout.write(f'  {label}: median {median:.2f} ms, best {best:.2f} ms')
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+
+    def get_queries(self, user, other_user):
+        task = Task.objects.filter(user=user).first()
+        return {
+            'tasks by status': Task.objects.filter(user=user, status='Pending').order_by('due_date')[:50],
+            'tasks by priority': Task.objects.filter(user=user, priority='High').order_by('due_date')[:50],
+            'tasks by due date': Task.objects.filter(user=user, due_date=timezone.localdate()),
+            'notifications': Notification.objects.filter(user=user).order_by('-created_at')[:50],
+            'unread notifications': Notification.objects.filter(user=user, is_read=False).order_by('-created_at')[:50],
+            'share lookup': SharedTask.objects.filter(task=task, shared_with=other_user),
+            'tasks shared with user': SharedTask.objects.filter(shared_with=user),
+            'history of owned tasks': TaskHistory.objects.filter(task__user=user).order_by('-completed_at')[:50],
+        }
+
+    def run(self, queries, repeat):
+        return {
+            name: (queryset.explain(), *timed(lambda: list(queryset.all()), repeat))
+            for name, queryset in queries.items()
+        }
+
+    def drop_indexes(self):
+        with connection.schema_editor() as schema_editor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    schema_editor.remove_index(model, index)
+
+    def create_indexes(self):
+        with connection.schema_editor() as schema_editor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    schema_editor.add_index(model, index)
@@ -0,0 +1,103 @@
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+
+MODES = ('persistent', 'per-request', 'pool')
+PERCENTILES = (50, 95, 99)
+
+
+def mode_settings(base, mode, pool_size):
+    settings_dict = copy.deepcopy(base)
+    settings_dict['OPTIONS'].pop('pool', None)
+    if mode == 'persistent':
+        settings_dict['CONN_MAX_AGE'] = 600
+    else:
+        settings_dict['CONN_MAX_AGE'] = 0
+        if mode == 'pool':
+            settings_dict['OPTIONS']['pool'] = {'min_size': pool_size, 'max_size': pool_size, 'timeout': 30}
+    return settings_dict
+
+
+def server_connections(stop, peak):
+    # Sample how many connections the database has open, from a connection of its own
+    with connections['default'].cursor() as cursor:
+        while not stop.is_set():
+            cursor.execute('SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()')
+            peak[0] = max(peak[0], cursor.fetchone()[0])
+            stop.wait(0.02)
+    connections['default'].close()
+
+
+def worker(alias, requests, query_seconds, hold_seconds):
+    # Each iteration is a request: it queries, keeps the connection while it renders the response, and ends
+    # the way request_finished does, which closes the connection or returns it to the pool
+    latencies, errors = [], 0
+    connection = connections[alias]
+    for _ in range(requests):
+        start = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_sleep(%s)', [query_seconds])
+            time.sleep(hold_seconds)
+        except DatabaseError:
+            errors += 1
+        finally:
+            connection.close_if_unusable_or_obsolete()
+        latencies.append((time.perf_counter() - start) * 1000)
+    connection.close()
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = ('Compare request throughput at high concurrency with persistent per-thread connections, a connection '
+            'per request and the connection pool. Runs read-only queries against the configured PostgreSQL database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=100, help='Worker threads, each one request at a time.')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per thread.')
+        parser.add_argument('--query-ms', type=float, default=2, help='Time each request spends in SQL.')
+        parser.add_argument('--hold-ms', type=float, default=5, help='Time each request holds its connection after the query.')
+        parser.add_argument('--pool-size', type=int, default=20)
+        parser.add_argument('--mode', action='append', choices=MODES, help='Only run this mode; repeatable.')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'postgresql':
+            raise CommandError('benchmark_pool needs DATABASE_URL to point at PostgreSQL.')
+        concurrency = options['concurrency']
+        self.stdout.write(
+            f"{concurrency} threads x {options['requests']} requests, {options['query_ms']:g} ms query, "
+            f"{options['hold_ms']:g} ms held, pool of {options['pool_size']}"
+        )
+        self.stdout.write(f"{'mode':12} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>8} {'peak conns':>11}")
+        base = connections['default'].settings_dict
+        for mode in options['mode'] or MODES:
+            alias = f'benchmark_{mode}'
+            connections.settings[alias] = mode_settings(base, mode, options['pool_size'])
+            stop, peak = threading.Event(), [0]
+            monitor = threading.Thread(target=server_connections, args=(stop, peak))
+            monitor.start()
+            try:
+                started = time.perf_counter()
+                with ThreadPoolExecutor(concurrency) as executor:
+                    results = list(executor.map(
+                        lambda _: worker(alias, options['requests'], options['query_ms'] / 1000, options['hold_ms'] / 1000),
+                        range(concurrency),
+                    ))
+                elapsed = time.perf_counter() - started
+            finally:
+                stop.set()
+                monitor.join()
+                connections[alias].close_pool()
+                del connections.settings[alias]
+
+            latencies = sorted(latency for thread_latencies, _ in results for latency in thread_latencies)
+            errors = sum(thread_errors for _, thread_errors in results)
+            p50, p95, p99 = (latencies[min(len(latencies) - 1, len(latencies) * p // 100)] for p in PERCENTILES)
+            self.stdout.write(
+                f'{mode:12} {(len(latencies) - errors) / elapsed:8.0f} {p50:8.2f} {p95:8.2f} {p99:8.2f} '
+                f'{errors:8} {peak[0]:11}'
+            )
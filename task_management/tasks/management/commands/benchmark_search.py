@@ -0,0 +1,50 @@
+import itertools
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from tasks.benchmark import analyze, benchmark_database, seed, timed
+from tasks.models import Task
+from tasks.search import search_backend, search_tasks
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'po', 'ba', 'du', 'fi', 'go', 'hu']
+
+
+def icontains(queryset, query):
+    # What searching without the index would look like
+    condition = Q()
+    for term in query.split():
+        condition &= Q(title__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition)
+
+
+class Command(BaseCommand):
+    help = 'Time ?search= through the full-text index against icontains on a large task table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        # 3375 three-syllable words, so single words match ~1% of tasks and pairs far fewer
+        vocabulary = [''.join(parts) for parts in itertools.product(SYLLABLES, repeat=3)]
+        with benchmark_database():
+            self.stdout.write('Seeding...')
+            user = seed(users=options['users'], tasks_per_user=options['tasks'] // options['users'], share_ratio=0,
+                        history_ratio=0, notifications_per_user=0, vocabulary=vocabulary)[0]
+            analyze()
+            self.stdout.write(f'Full-text backend: {search_backend("default") or "none (icontains)"}')
+
+            tasks = Task.objects.visible_to(user)
+            for query in (vocabulary[7], f'{vocabulary[7]} {vocabulary[42]}'):
+                self.stdout.write(self.style.MIGRATE_HEADING(f'search={query!r}'))
+                cases = {
+                    'all tasks, first page': lambda: list(search_tasks(Task.objects.all(), query).order_by('-search_rank', 'id')[:50]),
+                    'own tasks, first page': lambda: list(search_tasks(tasks, query).order_by('-search_rank', 'id')[:50]),
+                    'own pending tasks': lambda: list(search_tasks(tasks.filter(status='Pending'), query).order_by('-search_rank', 'id')[:50]),
+                    'icontains, own tasks': lambda: list(icontains(tasks, query).order_by('id')[:50]),
+                }
+                for name, func in cases.items():
+                    median, best = timed(func, options['repeat'])
+                    self.stdout.write(f'  {name}: median {median:.2f} ms, best {best:.2f} ms')
@@ -0,0 +1,50 @@
+from collections import Counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tasks.benchmark import analyze, benchmark_database, seed, timed
+from tasks.models import Task, TaskHistory
+from tasks.serializers import TaskSerializer, TaskHistorySerializer
+from tasks.stats import compute_task_stats, task_stats
+
+
+def client_side_stats(user):
+    # What the front end did: download both lists and count in Python
+    tasks = TaskSerializer(Task.objects.visible_to(user).select_related('category').prefetch_related('sharedtask'), many=True).data
+    history = TaskHistorySerializer(TaskHistory.objects.filter(task__user=user).select_related('task', 'user'), many=True).data
+    today = str(timezone.localdate())
+    return {
+        'by_status': Counter(task['status'] for task in tasks),
+        'by_priority': Counter(task['priority'] for task in tasks),
+        'by_category': Counter(task['category']['id'] if task['category'] else None for task in tasks),
+        'overdue': sum(task['status'] == 'Pending' and task['due_date'] < today for task in tasks),
+        'completed_per_day': Counter(entry['completed_at'][:10] for entry in history),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare counting a user\'s tasks in Python with the aggregated and cached /api/tasks/stats/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        with benchmark_database():
+            self.stdout.write('Seeding...')
+            user = seed(users=1, tasks_per_user=options['tasks'], categories_per_user=10, share_ratio=0,
+                        notifications_per_user=0)[0]
+            analyze()
+            cache.clear()
+
+            cases = (
+                ('serialize lists, count in Python', lambda: client_side_stats(user), 1),
+                ('aggregate in the database', lambda: compute_task_stats(user), repeat),
+                ('cached', lambda: task_stats(user), repeat),
+            )
+            for label, func, times in cases:
+                median, best = timed(func, times)
+                self.stdout.write(f'{label}: median {median:.2f} ms, best {best:.2f} ms')
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from tasks.benchmark import analyze, benchmark_database, seed, timed
+from tasks.models import Task
+
+
+def or_join_tasks(user):
+    # The previous TaskViewSet.get_queryset
+    return Task.objects.filter(user=user) | Task.objects.filter(sharedtask__shared_with=user)
+
+
+class Command(BaseCommand):
+    help = 'Compare the OR/join form of the owned-or-shared task query with Task.objects.visible_to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=10000, help='Owned and shared tasks per user.')
+        parser.add_argument('--other-users', type=int, default=50, help='Users with unrelated tasks.')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        with benchmark_database():
+            self.stdout.write('Seeding...')
+            seed(users=options['other_users'], tasks_per_user=options['tasks'] // 10, share_ratio=0,
+                 history_ratio=0, notifications_per_user=0)
+            # Two users whose tasks are all shared with each other: N owned plus N shared each
+            user = seed(users=2, tasks_per_user=options['tasks'], share_ratio=1, history_ratio=0,
+                        notifications_per_user=0)[0]
+            analyze()
+            task_id = Task.objects.filter(sharedtask__shared_with=user).values_list('id', flat=True).last()
+
+            forms = (
+                ('OR join', or_join_tasks(user), or_join_tasks(user)),
+                ('visible_to', Task.objects.visible_to(user), Task.objects.visible_to(user, point_lookup=True)),
+            )
+            for label, queryset, detail_queryset in forms:
+                self.stdout.write(self.style.MIGRATE_HEADING(label))
+                self.stdout.write(f'  rows: {queryset.count()} ({queryset.distinct().count()} distinct)')
+                cases = {
+                    'list': lambda: list(queryset.order_by('due_date', 'id').values_list('id', flat=True)),
+                    'first page': lambda: list(queryset.order_by('due_date', 'id')[:50]),
+                    'filtered page': lambda: list(
+                        queryset.filter(status='Pending', priority='High').order_by('due_date', 'id')[:50]
+                    ),
+                    'get_object': lambda: detail_queryset.get(pk=task_id),
+                }
+                for name, func in cases.items():
+                    median, best = timed(func, repeat)
+                    self.stdout.write(f'  {name}: median {median:.2f} ms, best {best:.2f} ms')
+                self.stdout.write('  list plan:')
+                for line in queryset.order_by('due_date', 'id').explain().splitlines():
+                    self.stdout.write(f'    {line}')
+                self.stdout.write('  get_object plan:')
+                for line in detail_queryset.filter(pk=task_id).explain().splitlines():
+                    self.stdout.write(f'    {line}')
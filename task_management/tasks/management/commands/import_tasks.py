@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.importer import BATCH_SIZE, FORMATS, PARSERS, TaskImporter, detect_format
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Import tasks for a user from a CSV, NDJSON or JSON array file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Tasks inserted per transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Could not tell the format from the file name; pass --format.')
+
+        with open(options['path'], encoding='utf-8-sig', newline='') as text:
+            summary = TaskImporter(user, batch_size=options['batch_size']).run(PARSERS[file_format](text))
+        for error in summary['errors']:
+            self.stderr.write(f'Row {error["row"]}: {error["errors"]}')
+        self.stdout.write(f'Imported {summary["created"]} tasks, {summary["failed"]} rows failed.')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks.models import Task, TaskOccurrence
+from tasks.recurrence import RULES
+
+
+class Command(BaseCommand):
+    help = 'Roll the materialized occurrences of every recurring task forward to today. Run it daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=None, help='Occurrences to keep from today on.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        tasks = Task.objects.filter(recurrence__in=list(RULES)).only(
+            'id', 'user_id', 'due_date', 'next_due_date', 'recurrence', 'status'
+        ).order_by('pk')
+        batch_size = options['batch_size']
+        synced = 0
+        batch = []
+        for task in tasks.iterator(chunk_size=batch_size):
+            batch.append(task)
+            if len(batch) >= batch_size:
+                with transaction.atomic():
+                    TaskOccurrence.objects.sync(batch, count=options['ahead'])
+                synced += len(batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                TaskOccurrence.objects.sync(batch, count=options['ahead'])
+            synced += len(batch)
+        # Tasks that stopped recurring keep no occurrences
+        TaskOccurrence.objects.exclude(task__recurrence__in=list(RULES)).delete()
+        self.stdout.write(f'Synced occurrences for {synced} recurring tasks.')
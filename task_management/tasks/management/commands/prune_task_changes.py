@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tasks.changes import prune, retention
+
+
+class Command(BaseCommand):
+    help = 'Delete task change log rows older than TASK_CHANGES_RETENTION_DAYS. Run it daily.'
+
+    def handle(self, *args, **options):
+        deleted = prune()
+        self.stdout.write(f'Deleted {deleted} changes older than {retention().days} days.')
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from tasks.scheduler import ReminderScheduler
+
+
+class Command(BaseCommand):
+    help = ('Send due and overdue reminders and roll overdue recurring tasks forward. Run it from cron, '
+            'or with --interval as a worker; several can run at once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None, help='Seconds between runs; run once without it.')
+        parser.add_argument('--lead-days', type=int, default=None, help='Remind this many days ahead (TASK_REMINDER_LEAD_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        scheduler = ReminderScheduler(lead_days=options['lead_days'], batch_size=options['batch_size'])
+        while True:
+            close_old_connections()
+            totals = scheduler.run()
+            self.stdout.write(
+                f"Sent {totals['reminders']} reminders ({totals['notifications']} notifications), "
+                f"rolled over {totals['rolled_over']} recurring tasks."
+            )
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from tasks.benchmark import seed
+
+
+class Command(BaseCommand):
+    help = ('Fill the configured database with synthetic users (bench<N>), categories, tasks, shares, history '
+            'and notifications, for trying out the API or profiling it locally.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--tasks-per-user', type=int, default=1000)
+        parser.add_argument('--categories-per-user', type=int, default=5)
+        parser.add_argument('--share-ratio', type=float, default=0.1)
+        parser.add_argument('--history-ratio', type=float, default=0.2)
+        parser.add_argument('--recurring-ratio', type=float, default=0.1)
+        parser.add_argument('--notifications-per-user', type=int, default=100)
+        parser.add_argument('--unread-ratio', type=float, default=0.2)
+        parser.add_argument('--password', default=None, help='Password of the seeded users; without it they cannot log in.')
+        parser.add_argument('--random-seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        users = seed(
+            users=options['users'],
+            tasks_per_user=options['tasks_per_user'],
+            categories_per_user=options['categories_per_user'],
+            share_ratio=options['share_ratio'],
+            history_ratio=options['history_ratio'],
+            recurring_ratio=options['recurring_ratio'],
+            notifications_per_user=options['notifications_per_user'],
+            unread_ratio=options['unread_ratio'],
+            password=options['password'],
+            random_seed=options['random_seed'],
+        )
+        self.stdout.write(f'Seeded {len(users)} users, {users[0].username} to {users[-1].username}.')
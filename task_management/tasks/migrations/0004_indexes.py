@@ -0,0 +1,52 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:02
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_shares(apps, schema_editor):
+    # Keep the oldest share for each (task, shared_with) pair so the unique constraint can be added
+    SharedTask = apps.get_model('tasks', 'SharedTask')
+    keep = SharedTask.objects.values('task', 'shared_with').annotate(first_id=Min('id')).values('first_id')
+    SharedTask.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0003_taskhistory_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at'], name='notification_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='notification_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sharedtask',
+            index=models.Index(fields=['shared_with', 'task'], name='sharedtask_user_task_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'due_date'], name='task_user_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'status', 'due_date'], name='task_user_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'priority', 'due_date'], name='task_user_priority_due_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_shares, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='sharedtask',
+            constraint=models.UniqueConstraint(fields=('task', 'shared_with'), name='unique_task_share'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_notification_counter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='task',
+            name='recurrence',
+            field=models.CharField(choices=[('None', 'None'), ('Daily', 'Daily'), ('Weekdays', 'Weekdays'), ('Weekly', 'Weekly'), ('Biweekly', 'Biweekly'), ('Monthly', 'Monthly'), ('Quarterly', 'Quarterly'), ('Yearly', 'Yearly')], default='None', max_length=50),
+        ),
+        migrations.CreateModel(
+            name='TaskOccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_date', models.DateField()),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='tasks.task')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_occurrences', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'due_date'], name='occurrence_user_due_idx')],
+                'constraints': [models.UniqueConstraint(fields=('task', 'due_date'), name='unique_task_occurrence')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+from django.db import OperationalError, migrations
+
+# Frozen copies of the SQL in tasks.search at the time of this migration, so that later changes to
+# that module do not change what this migration does.
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE tasks_task ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX IF NOT EXISTS task_search_idx ON tasks_task USING GIN (search_vector)',
+]
+POSTGRES_UNINSTALL = [
+    'DROP INDEX IF EXISTS task_search_idx',
+    'ALTER TABLE tasks_task DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_INSTALL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_task_fts_insert AFTER INSERT ON tasks_task BEGIN
+        INSERT INTO tasks_task_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_task_fts_delete AFTER DELETE ON tasks_task BEGIN
+        INSERT INTO tasks_task_fts (tasks_task_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_task_fts_update AFTER UPDATE OF title, description ON tasks_task BEGIN
+        INSERT INTO tasks_task_fts (tasks_task_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO tasks_task_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    "INSERT INTO tasks_task_fts (tasks_task_fts) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS tasks_task_fts_insert',
+    'DROP TRIGGER IF EXISTS tasks_task_fts_delete',
+    'DROP TRIGGER IF EXISTS tasks_task_fts_update',
+    'DROP TABLE IF EXISTS tasks_task_fts',
+]
+
+
+def install_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for sql in POSTGRES_INSTALL:
+            schema_editor.execute(sql)
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_task_fts USING fts5("
+                "title, description, content='tasks_task', content_rowid='id', tokenize='porter unicode61')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5; searches fall back to icontains
+            return
+        for sql in SQLITE_INSTALL:
+            schema_editor.execute(sql)
+
+
+def uninstall_search(apps, schema_editor):
+    statements = {'postgresql': POSTGRES_UNINSTALL, 'sqlite': SQLITE_UNINSTALL}.get(schema_editor.connection.vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0006_task_occurrences'),
+    ]
+
+    operations = [
+        # A generated tsvector column with a GIN index on PostgreSQL, an FTS5 table with triggers on SQLite
+        migrations.RunPython(install_search, uninstall_search),
+    ]
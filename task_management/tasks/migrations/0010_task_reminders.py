@@ -0,0 +1,39 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:36
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0009_task_changes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_date', models.DateField()),
+                ('kind', models.CharField(choices=[('due', 'Due'), ('overdue', 'Overdue')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(django.db.models.functions.comparison.Coalesce('next_due_date', 'due_date'), condition=models.Q(('status', 'Pending')), name='task_pending_current_due_idx'),
+        ),
+        migrations.AddField(
+            model_name='taskreminder',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='tasks.task'),
+        ),
+        migrations.AddConstraint(
+            model_name='taskreminder',
+            constraint=models.UniqueConstraint(fields=('task', 'due_date', 'kind'), name='unique_task_reminder'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0010_task_reminders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationcounter',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -2,8 +2,11 @@ from django.db import models
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from . import recurrence
+
 
 
 
@@ -14,6 +17,18 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class TaskQuerySet(models.QuerySet):
+    def visible_to(self, user, point_lookup=False):
+        # Tasks the user owns or that are shared with them, without the duplicate rows that
+        # joining through SharedTask produces. Lists get a UNION of the two index paths; single
+        # rows are cheaper to check with a correlated EXISTS than by building the whole union.
+        shared = SharedTask.objects.filter(shared_with=user)
+        if point_lookup:
+            return self.filter(models.Q(user=user) | models.Exists(shared.filter(task=models.OuterRef('pk'))))
+        owned_ids = Task.objects.filter(user=user).values('pk')
+        return self.filter(pk__in=owned_ids.union(shared.values('task_id')))
+
+
 class Task(models.Model):
     PRIORITY_CHOICES = [
         ('Low', 'Low'),
@@ -27,10 +42,18 @@ class Task(models.Model):
     RECURRENCE_CHOICES = [
         ('None', 'None'),
         ('Daily', 'Daily'),
+        ('Weekdays', 'Weekdays'),
         ('Weekly', 'Weekly'),
-        ('Monthly', 'Monthly')
+        ('Biweekly', 'Biweekly'),
+        ('Monthly', 'Monthly'),
+        ('Quarterly', 'Quarterly'),
+        ('Yearly', 'Yearly'),
     ]
 
+    # On PostgreSQL, migration 0007 adds a search_vector column generated from title and description
+    # that the model does not know about (see tasks.search). PostgreSQL refuses to alter the type of a
+    # column a generated column uses, so a migration changing either field must drop search_vector
+    # first and add it back after, with RunSQL.
     title = models.CharField(max_length=100)
     description = models.TextField()
     due_date = models.DateField()
@@ -41,6 +64,49 @@ class Task(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     recurrence = models.CharField(max_length=50, choices=RECURRENCE_CHOICES, default='None')
     next_due_date = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'due_date'], name='task_user_due_idx'),
+            models.Index(fields=['user', 'status', 'due_date'], name='task_user_status_due_idx'),
+            models.Index(fields=['user', 'priority', 'due_date'], name='task_user_priority_due_idx'),
+            # The scheduler scans pending tasks by the date they are currently due
+            models.Index(
+                Coalesce('next_due_date', 'due_date'),
+                condition=models.Q(status='Pending'),
+                name='task_pending_current_due_idx',
+            ),
+        ]
+
+    def apply_changes(self, data, completed_at=None):
+        """Set the fields in ``data``, with the side effects every edit path shares."""
+        completing = data.get('status') == 'Completed' and self.status != 'Completed'
+        # Reverting to incomplete clears the completion time
+        if data.get('status') == 'Pending' and self.status == 'Completed':
+            self.completed_at = None
+        # Moving the due date or changing the rule restarts the series from the new due date
+        if any(field in data and data[field] != getattr(self, field) for field in ('due_date', 'recurrence')):
+            self.next_due_date = None
+        for field, value in data.items():
+            setattr(self, field, value)
+        if completing:
+            self.complete(completed_at)
+
+    def complete(self, completed_at=None):
+        self.status = 'Completed'
+        self.completed_at = completed_at or timezone.now()
+        # Recurring tasks move on to their next occurrence and stay pending
+        if self.recurrence in recurrence.RULES:
+            self.next_due_date = recurrence.next_occurrence(self.recurrence, self.due_date, self.current_due_date)
+            self.status = 'Pending'
+
+    @property
+    def current_due_date(self):
+        # due_date anchors a recurring series; next_due_date is the occurrence that is currently due
+        return self.next_due_date or self.due_date
 
     def clean(self):
         if self.due_date < timezone.now():
@@ -48,6 +114,102 @@ class Task(models.Model):
     def __str__(self):
         return self.title
     
+class TaskOccurrenceQuerySet(models.QuerySet):
+    def sync(self, tasks, count=None, today=None):
+        """
+        Make the materialized occurrences of ``tasks`` match their recurrence: the currently
+        due occurrence plus the next ``count`` from today on. Only missing rows are inserted
+        and only stale ones deleted, so rolling a series forward touches a couple of rows.
+        """
+        count = count or getattr(settings, 'TASK_OCCURRENCES_AHEAD', 10)
+        today = today or timezone.localdate()
+        wanted = {}
+        for task in tasks:
+            dates = set()
+            if task.recurrence in recurrence.RULES and task.status != 'Completed':
+                current = task.current_due_date
+                dates = {current, *recurrence.occurrences(task.recurrence, task.due_date, max(current, today), count)}
+            wanted[task.pk] = (task.user_id, dates)
+        if not wanted:
+            return
+
+        stale = []
+        for pk, task_id, due_date in self.filter(task_id__in=wanted).values_list('pk', 'task_id', 'due_date'):
+            dates = wanted[task_id][1]
+            if due_date in dates:
+                dates.discard(due_date)
+            else:
+                stale.append(pk)
+        if stale:
+            self.filter(pk__in=stale).delete()
+        self.bulk_create([
+            TaskOccurrence(task_id=task_id, user_id=user_id, due_date=due_date)
+            for task_id, (user_id, dates) in wanted.items() for due_date in dates
+        ], ignore_conflicts=True)
+
+
+class TaskOccurrence(models.Model):
+    # Upcoming occurrences of recurring tasks, kept by TaskOccurrence.objects.sync so date range
+    # queries across every series are an index scan. user is the task owner, copied for that index.
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='occurrences')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='task_occurrences')
+    due_date = models.DateField()
+
+    objects = TaskOccurrenceQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'due_date'], name='unique_task_occurrence'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'due_date'], name='occurrence_user_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task.title} due on {self.due_date}'
+
+
+class TaskChange(models.Model):
+    # One row per user whose view of a task changed, read by /api/tasks/changes/. task_id is not a
+    # foreign key so rows outlive deleted tasks and act as tombstones.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='task_changes')
+    task_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='taskchange_user_id_idx'),
+            models.Index(fields=['created_at'], name='taskchange_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'Task {self.task_id} changed for user {self.user_id}'
+
+
+class TaskReminder(models.Model):
+    # One row per reminder tasks.scheduler has sent, so each goes out once however often and in
+    # however many processes it runs
+    DUE = 'due'
+    OVERDUE = 'overdue'
+    KIND_CHOICES = [
+        (DUE, 'Due'),
+        (OVERDUE, 'Overdue'),
+    ]
+
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='reminders')
+    due_date = models.DateField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'due_date', 'kind'], name='unique_task_reminder'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} reminder for task {self.task_id} on {self.due_date}'
+
+
 class TaskHistory(models.Model):
     task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='history')
     completed_at = models.DateTimeField()
@@ -64,13 +226,46 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notification_user_created_idx'),
+            # Unread notifications are a small slice of the table, so keep them in their own index
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=models.Q(is_read=False),
+                name='notification_unread_idx',
+            ),
+            # Serves ?since=<id> polling
+            models.Index(fields=['user', 'id'], name='notification_user_id_idx'),
+        ]
+
     def __str__(self):
         return f'Notification for {self.user.username}: {self.message}'
     
+class NotificationCounter(models.Model):
+    # Kept in sync by tasks.notifications so polling clients can read the unread count in O(1).
+    # version goes up with every write to the user's notifications, for ETags (see tasks.cache).
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+    latest_id = models.BigIntegerField(default=0)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.unread} unread notifications for user {self.user_id}'
+
+
 class SharedTask(models.Model):
     task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='sharedtask')
     shared_with = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     can_edit = models.BooleanField(default=False)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'shared_with'], name='unique_task_share'),
+        ]
+        indexes = [
+            models.Index(fields=['shared_with', 'task'], name='sharedtask_user_task_idx'),
+        ]
+
     def __str__(self):
         return f'Task {self.task.title} shared with {self.shared_with.username}'    
\ No newline at end of file
@@ -0,0 +1,269 @@
+"""
+Queued notification delivery.
+
+Views call ``create_task_notification``; once the surrounding transaction
+commits, the notification is handed to a dispatcher that writes batches
+with ``bulk_create`` from a background thread, merging duplicates for the
+same user, task and event that arrive within ``MERGE_WINDOW`` seconds.
+Set ``TASK_NOTIFICATIONS['ASYNC'] = False`` to write in the calling thread.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.dispatch import Signal, receiver
+from django.utils.module_loading import import_string
+
+from .models import Task, Notification, NotificationCounter
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'tasks.notifications.DatabaseBackend',
+    'ASYNC': True,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 0.5,
+    'MERGE_WINDOW': 5,
+}
+
+# Sent with the saved Notification rows, inside the transaction of every batch the database backend writes
+notifications_created = Signal()
+
+_STOP = object()
+
+
+class DatabaseBackend:
+    def write(self, notifications):
+        try:
+            return self._write(notifications)
+        except IntegrityError:
+            # A task was deleted while its notification was queued; drop those and retry once
+            existing = set(Task.objects.filter(pk__in={n.task_id for n in notifications}).values_list('pk', flat=True))
+            return self._write([n for n in notifications if n.task_id in existing])
+
+    def _write(self, notifications):
+        # Receivers run in the same transaction as the insert, so counters never see half a batch
+        with transaction.atomic():
+            created = Notification.objects.bulk_create(notifications)
+            notifications_created.send(sender=Notification, notifications=created)
+        return created
+
+
+class InMemoryBackend:
+    # Collects notifications instead of saving them, for tests
+    def __init__(self):
+        self.notifications = []
+
+    def write(self, notifications):
+        self.notifications.extend(notifications)
+        return notifications
+
+
+class NotificationDispatcher:
+    def __init__(self, backend, run_async=True, batch_size=500, flush_interval=0.5, merge_window=5):
+        self.backend = backend
+        self.run_async = run_async
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.merge_window = merge_window
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def enqueue(self, events):
+        """Queue ``(event, notification)`` pairs for writing."""
+        now = time.monotonic()
+        items = [((notification.user_id, notification.task_id, event), notification, now) for event, notification in events]
+        if not self.run_async:
+            self._write(items)
+            return
+        self._ensure_worker()
+        for item in items:
+            self._queue.put(item)
+
+    def flush(self):
+        """Block until everything queued so far has been written."""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def shutdown(self, timeout=10):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so pre-forked workers each start their own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            close_old_connections()
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception('Failed to write %d notifications', len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        connection.close()
+
+    def _write(self, items):
+        # Later duplicates replace earlier ones in the batch; anything already written for the same
+        # key within the merge window is dropped
+        pending = {}
+        with self._lock:
+            for key, notification, queued_at in items:
+                written_at = self._recent.get(key)
+                if written_at is not None and queued_at - written_at < self.merge_window:
+                    continue
+                pending[key] = notification
+                self._recent[key] = queued_at
+            now = time.monotonic()
+            self._recent = {key: at for key, at in self._recent.items() if now - at < self.merge_window}
+        if pending:
+            self.backend.write(list(pending.values()))
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                config = {**DEFAULTS, **getattr(settings, 'TASK_NOTIFICATIONS', {})}
+                _dispatcher = NotificationDispatcher(
+                    import_string(config['BACKEND'])(),
+                    run_async=config['ASYNC'],
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL'],
+                    merge_window=config['MERGE_WINDOW'],
+                )
+    return _dispatcher
+
+
+@atexit.register
+def _shutdown():
+    if _dispatcher is not None:
+        _dispatcher.shutdown()
+
+
+@receiver(setting_changed)
+def _reset_dispatcher(setting, **kwargs):
+    global _dispatcher
+    if setting == 'TASK_NOTIFICATIONS':
+        _shutdown()
+        _dispatcher = None
+
+
+def task_notification(user, task):
+    return Notification(user_id=user.pk, task_id=task.pk, message=f'Task "{task.title}" is due on {task.due_date}.')
+
+
+def create_task_notifications(pairs, event):
+    """Queue one notification per ``(user, task)`` pair once the current transaction commits."""
+    events = [(event, task_notification(user, task)) for user, task in pairs]
+    if events:
+        transaction.on_commit(lambda: get_dispatcher().enqueue(events))
+
+
+def create_task_notification(user, task, event):
+    create_task_notifications([(user, task)], event)
+
+
+def get_unread_count(user):
+    """Return ``(unread, latest_id)`` for the user from their counter row."""
+    counter = NotificationCounter.objects.filter(user=user).values_list('unread', 'latest_id').first()
+    if counter is None:
+        counter = recount_unread([user.pk])[user.pk]
+    return counter
+
+
+def recount_unread(user_ids):
+    counters = {}
+    for user_id in user_ids:
+        # Counted in a transaction so the reads go to the primary (see db_router): the counter only
+        # moves by increments afterwards, so a count from a lagging replica would stay wrong
+        with transaction.atomic(savepoint=False):
+            notifications = Notification.objects.filter(user_id=user_id)
+            unread = notifications.filter(is_read=False).count()
+            latest_id = notifications.order_by('-id').values_list('id', flat=True).first() or 0
+            if not NotificationCounter.objects.filter(user_id=user_id).update(
+                unread=unread, latest_id=latest_id, version=F('version') + 1
+            ):
+                NotificationCounter.objects.update_or_create(
+                    user_id=user_id, defaults={'unread': unread, 'latest_id': latest_id, 'version': 1}
+                )
+        counters[user_id] = (unread, latest_id)
+    return counters
+
+
+def notification_users(task_ids):
+    # Deleting these tasks cascades to the notifications of these users
+    return set(Notification.objects.filter(task_id__in=task_ids).values_list('user_id', flat=True).distinct())
+
+
+def mark_read(notifications, user):
+    """Mark the given notifications of ``user`` as read and decrement their counter."""
+    updated = notifications.filter(is_read=False).update(is_read=True)
+    if updated and not NotificationCounter.objects.filter(user=user).update(
+        unread=Greatest(F('unread') - updated, 0), version=F('version') + 1
+    ):
+        recount_unread([user.pk])
+    return updated
+
+
+@receiver(notifications_created)
+def _count_created(sender, notifications, **kwargs):
+    added = {}
+    for notification in notifications:
+        unread, latest_id = added.get(notification.user_id, (0, 0))
+        added[notification.user_id] = (unread + (not notification.is_read), max(latest_id, notification.pk or 0))
+    missing = [
+        user_id for user_id, (unread, latest_id) in added.items()
+        if not NotificationCounter.objects.filter(user_id=user_id).update(
+            unread=F('unread') + unread, latest_id=Greatest(F('latest_id'), latest_id), version=F('version') + 1
+        )
+    ]
+    # Users without a counter yet get one counted from scratch, which includes this batch
+    recount_unread(missing)
@@ -0,0 +1,141 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opt-in keyset pagination.
+
+    Responses stay plain lists unless the client sends ``page_size`` or
+    ``cursor``. Pages are read with ``WHERE (key, id) > (last_key, last_id)``
+    instead of OFFSET, so deep pages cost the same as the first one. The keys
+    are the queryset's ordering (including ``OrderingFilter``), or the view's
+    ``keyset_ordering``, with the primary key appended as a tiebreaker.
+    """
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(queryset.model, position))
+
+        # Fetch one extra row to find out whether there is a next page
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset, view):
+        ordering = list(queryset.query.order_by) or list(getattr(view, 'keyset_ordering', []))
+        pk_name = queryset.model._meta.pk.name
+        if not any(field.lstrip('-') in ('pk', pk_name) for field in ordering):
+            ordering.append(pk_name)
+        return tuple(ordering)
+
+    def get_keyset_filter(self, model, position):
+        # (a, b, c) > (x, y, z) expands to a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        keyset_filter = Q()
+        equal = {}
+        for field, value in zip(self.ordering, self.to_python(model, position)):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            keyset_filter |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return keyset_filter
+
+    def get_position(self, obj):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            try:
+                name = obj._meta.get_field(name).attname
+            except FieldDoesNotExist:
+                pass
+            position.append(getattr(obj, name))
+        return position
+
+    def encode_cursor(self, obj):
+        payload = json.dumps({'o': self.ordering, 'p': self.get_position(obj)}, cls=DjangoJSONEncoder)
+        return urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()))
+            ordering, position = tuple(payload['o']), payload['p']
+        except (BinasciiError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # A cursor is only valid for the ordering it was issued for
+        if ordering != self.ordering or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def to_python(self, model, position):
+        values = []
+        for field, value in zip(self.ordering, position):
+            try:
+                model_field = model._meta.get_field(field.lstrip('-'))
+            except FieldDoesNotExist:
+                # Annotations are compared with the raw JSON value
+                values.append(value)
+                continue
+            try:
+                values.append(model_field.to_python(value))
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
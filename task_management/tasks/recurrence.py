@@ -0,0 +1,89 @@
+"""
+Recurrence rules for tasks.
+
+Every occurrence is computed from the series anchor (the task's ``due_date``)
+rather than from the previous occurrence, so month-based rules clamp to the
+end of short months without drifting: a series anchored on Jan 31 falls on
+Feb 28 (or 29), then Mar 31.
+"""
+import calendar
+from datetime import timedelta
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def add_weekdays(day, count):
+    # A weekend anchor counts from the Friday before it, so its first step is the following Monday
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    weeks, remainder = divmod(count, 5)
+    day += timedelta(weeks=weeks)
+    while remainder:
+        day += timedelta(days=1)
+        if day.weekday() < 5:
+            remainder -= 1
+    return day
+
+
+class Rule:
+    def __init__(self, days=0, months=0, weekdays=False):
+        self.days = days
+        self.months = months
+        self.weekdays = weekdays
+
+    def nth(self, anchor, n):
+        """Return the ``n``-th occurrence of a series starting on ``anchor`` (``n=0`` is the anchor)."""
+        if n == 0:
+            return anchor
+        if self.weekdays:
+            return add_weekdays(anchor, n)
+        if self.months:
+            return add_months(anchor, n * self.months)
+        return anchor + timedelta(days=n * self.days)
+
+    def index_after(self, anchor, day):
+        """Return the index of the first occurrence strictly after ``day``."""
+        elapsed = (day - anchor).days
+        if elapsed < 0:
+            return 0
+        if self.weekdays:
+            n = max(elapsed * 5 // 7 - 2, 0)
+        elif self.months:
+            n = max(elapsed // (31 * self.months), 0)
+        else:
+            return elapsed // self.days + 1
+        # The estimate never overshoots; step forward the few remaining occurrences
+        while self.nth(anchor, n) <= day:
+            n += 1
+        return n
+
+
+RULES = {
+    'Daily': Rule(days=1),
+    'Weekdays': Rule(weekdays=True),
+    'Weekly': Rule(days=7),
+    'Biweekly': Rule(days=14),
+    'Monthly': Rule(months=1),
+    'Quarterly': Rule(months=3),
+    'Yearly': Rule(months=12),
+}
+
+
+def next_occurrence(recurrence, anchor, after):
+    """Return the first occurrence of the series after ``after``."""
+    rule = RULES[recurrence]
+    return rule.nth(anchor, rule.index_after(anchor, after))
+
+
+def occurrences(recurrence, anchor, start, count):
+    """Return up to ``count`` occurrences of the series on or after ``start``."""
+    rule = RULES.get(recurrence)
+    if rule is None:
+        return [anchor] if anchor >= start else []
+    first = rule.index_after(anchor, start - timedelta(days=1))
+    return [rule.nth(anchor, n) for n in range(first, first + count)]
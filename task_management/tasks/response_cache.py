@@ -0,0 +1,57 @@
+"""
+Cached ``list`` and ``retrieve`` responses.
+
+The serialized data of a 200 response is cached under the user's version in
+``cache_scope`` (see tasks.cache) and the absolute URL, which carries the
+filters, ordering, search, ``?fields=`` and cursor, and the host that
+pagination links are built with. Every write to a task, sharing it or
+renaming its category logs a TaskChange for its owner and the users it is
+shared with (see tasks.changes), and the version is read from that log in
+the database, so a cached response is never served after a change to
+anything in it, whichever process made the change. Entries of old versions
+are never read again and expire after ``TASK_RESPONSE_CACHE_TIMEOUT``
+seconds. With the default per-process cache each process keeps its own
+entries, which only costs hit rate; configure Redis to share them.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from task_management.instrumentation import registry
+
+from .cache import TASKS, request_version
+
+
+def timeout():
+    return getattr(settings, 'TASK_RESPONSE_CACHE_TIMEOUT', 300)
+
+
+class CachedResponseMixin:
+    cache_scope = TASKS
+
+    def get_response_cache_key(self, request):
+        digest = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+        return f'response:{self.basename}:{request.user.pk}:{request_version(request, self.cache_scope)}:{digest}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not timeout():
+            return handler(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        labels = {'view': f'{self.basename}-{self.action}', 'result': 'miss' if data is None else 'hit'}
+        registry.inc('response_cache_requests_total', labels)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, timeout())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
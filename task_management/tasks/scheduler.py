@@ -0,0 +1,126 @@
+"""
+Due-date reminders and recurrence roll-over, independent of API traffic.
+
+``run_scheduler`` calls ``ReminderScheduler.run`` once or on an interval.
+Each batch is one transaction that claims pending tasks due within
+``TASK_REMINDER_LEAD_DAYS`` (or overdue) with ``select_for_update(skip_locked=True)``,
+so several schedulers split the work instead of waiting on each other:
+
+- a task due soon gets a ``due`` reminder for its current occurrence,
+- an overdue task gets an ``overdue`` one, and a recurring series then moves
+  on to its first occurrence from today, with a ``due`` reminder for it in
+  the same batch if that falls within the lead time.
+
+A TaskReminder row records every reminder sent and takes the task out of
+later scans, so running the scheduler again sends nothing twice. Within a
+run, each batch starts after the ``(current_due, id)`` of the last task the
+previous batch claimed, so a run reads every due task once however many
+overdue tasks have already been reminded.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, CharField, Exists, OuterRef, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import recurrence
+from .changes import tasks_changed
+from .models import Notification, SharedTask, Task, TaskOccurrence, TaskReminder
+from .notifications import get_dispatcher
+
+MESSAGES = {
+    TaskReminder.DUE: 'Task "{title}" is due on {due_date}.',
+    TaskReminder.OVERDUE: 'Task "{title}" was due on {due_date}.',
+}
+
+
+class ReminderScheduler:
+    def __init__(self, lead_days=None, batch_size=500, today=None):
+        self.lead_days = getattr(settings, 'TASK_REMINDER_LEAD_DAYS', 1) if lead_days is None else lead_days
+        self.batch_size = batch_size
+        self.today = today
+
+    def due_tasks(self, today):
+        """Pending tasks due by the lead time with no reminder yet for their current occurrence."""
+        sent = TaskReminder.objects.filter(task=OuterRef('pk'), due_date=OuterRef('current_due'), kind=OuterRef('reminder'))
+        return Task.objects.annotate(
+            current_due=Coalesce('next_due_date', 'due_date'),
+        ).filter(
+            status='Pending', current_due__lte=today + timedelta(days=self.lead_days),
+        ).annotate(
+            reminder=Case(
+                When(current_due__lt=today, then=Value(TaskReminder.OVERDUE)),
+                default=Value(TaskReminder.DUE),
+                output_field=CharField(),
+            ),
+        ).filter(~Exists(sent)).only(
+            'id', 'title', 'due_date', 'next_due_date', 'recurrence', 'status', 'user_id'
+        ).order_by('current_due', 'id')
+
+    def run(self):
+        """Process batches until nothing is left to claim; returns the totals."""
+        today = self.today or timezone.localdate()
+        totals = {'reminders': 0, 'notifications': 0, 'rolled_over': 0}
+        after = None
+        while True:
+            batch = self.run_batch(today, after)
+            if batch is None:
+                return totals
+            counts, after = batch
+            for key, count in counts.items():
+                totals[key] += count
+
+    @transaction.atomic
+    def run_batch(self, today=None, after=None):
+        """
+        Claim and process one batch of the tasks due after ``after``, a ``(current_due, id)`` pair.
+        Returns the counts and the pair of the last task claimed, or None when there was nothing to claim.
+        """
+        today = today or self.today or timezone.localdate()
+        tasks = self.due_tasks(today)
+        if after is not None:
+            tasks = tasks.filter(Q(current_due__gt=after[0]) | Q(current_due=after[0], id__gt=after[1]))
+        tasks = list(tasks.select_for_update(skip_locked=True)[:self.batch_size])
+        if not tasks:
+            return None
+        last = (tasks[-1].current_due, tasks[-1].pk)
+        # Another scheduler may have finished these tasks after this one's query started. Now that
+        # they are locked, reminders read here are final.
+        sent = set(TaskReminder.objects.filter(task__in=tasks).values_list('task_id', 'due_date', 'kind'))
+        tasks = [task for task in tasks if (task.pk, task.current_due, task.reminder) not in sent]
+
+        rolled = [task for task in tasks if task.reminder == TaskReminder.OVERDUE and task.recurrence in recurrence.RULES]
+        now = timezone.now()
+        for task in rolled:
+            task.next_due_date = recurrence.next_occurrence(task.recurrence, task.due_date, today - timedelta(days=1))
+            task.updated_at = now
+        # (task, due_date, kind). A rolled series' new occurrence sorts behind the keyset of this run,
+        # so its due reminder goes out now rather than on a later run, by when it may be overdue.
+        reminders = [(task, task.current_due, task.reminder) for task in tasks] + [
+            (task, task.next_due_date, TaskReminder.DUE) for task in rolled
+            if task.next_due_date <= today + timedelta(days=self.lead_days)
+        ]
+
+        TaskReminder.objects.bulk_create([
+            TaskReminder(task=task, due_date=due_date, kind=kind) for task, due_date, kind in reminders
+        ])
+        recipients = {}
+        for task_id, user_id in SharedTask.objects.filter(task__in=tasks).values_list('task_id', 'shared_with_id'):
+            recipients.setdefault(task_id, []).append(user_id)
+        notifications = [
+            Notification(
+                user_id=user_id, task_id=task.pk,
+                message=MESSAGES[kind].format(title=task.title, due_date=due_date),
+            )
+            for task, due_date, kind in reminders for user_id in [task.user_id, *recipients.get(task.pk, [])]
+        ]
+        # Written directly rather than queued, so the reminders and their notifications commit together
+        get_dispatcher().backend.write(notifications)
+
+        if rolled:
+            Task.objects.bulk_update(rolled, ['next_due_date', 'updated_at'])
+            TaskOccurrence.objects.sync(rolled, today=today)
+            tasks_changed(rolled)
+        return {'reminders': len(reminders), 'notifications': len(notifications), 'rolled_over': len(rolled)}, last
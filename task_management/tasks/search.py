@@ -0,0 +1,125 @@
+"""
+Full-text search over task titles and descriptions.
+
+The index lives outside the ORM so the database keeps it in sync on every
+write path, bulk ones included. Migration 0007 creates whichever one the
+database supports:
+
+- PostgreSQL: a generated ``search_vector`` tsvector column (title weighted
+  above description) with a GIN index.
+- SQLite: an external-content FTS5 table kept up to date by triggers.
+
+SQLite drops a table's triggers when a migration rebuilds the table, as it
+does for most schema changes, so ``install_triggers`` recreates them after
+every ``migrate``. Databases with neither fall back to ``icontains`` on
+every search term.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'tasks_task_fts'
+
+SQLITE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_task_fts_insert AFTER INSERT ON tasks_task BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_task_fts_delete AFTER DELETE ON tasks_task BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_task_fts_update AFTER UPDATE OF title, description ON tasks_task BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+]
+
+
+def _sqlite_triggers(cursor):
+    cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'tasks_task_fts_%'")
+    return cursor.fetchone()[0]
+
+
+def install_triggers(connection):
+    """Recreate the SQLite triggers dropped by a rebuild of tasks_task, if its FTS5 table exists."""
+    if connection.vendor != 'sqlite' or FTS_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        if _sqlite_triggers(cursor) == len(SQLITE_TRIGGERS):
+            return
+        for sql in SQLITE_TRIGGERS:
+            cursor.execute(sql)
+        # Rows written while the triggers were missing are picked up by rebuilding from tasks_task
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+    _backends.pop(connection.alias, None)
+
+
+_backends = {}
+
+
+def search_backend(alias):
+    if alias not in _backends:
+        connection = connections[alias]
+        backend = None
+        if connection.vendor == 'postgresql':
+            backend = 'postgresql'
+        elif connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+            backend = 'sqlite'
+        _backends[alias] = backend
+    return _backends[alias]
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query)[:32]
+
+
+def search_tasks(queryset, query):
+    """Filter ``queryset`` to tasks matching every word of ``query``, annotated with ``search_rank``."""
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+    backend = search_backend(queryset.db)
+    if backend == 'postgresql':
+        tsquery = f"plainto_tsquery('{SEARCH_CONFIG}', %s)"
+        return queryset.filter(
+            RawSQL(f'"tasks_task"."search_vector" @@ {tsquery}', [' '.join(terms)], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(f'ts_rank("tasks_task"."search_vector", {tsquery})', [' '.join(terms)], output_field=FloatField())
+        )
+    if backend == 'sqlite':
+        # Join the FTS table so it is searched once and bm25 (lower is better) is read per row;
+        # the title weighs ten times the description. Quoting every term keeps FTS5 query
+        # syntax in user input from being interpreted.
+        match = ' '.join(f'"{term}"' for term in terms)
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = "tasks_task"."id"', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        ).annotate(search_rank=RawSQL(f'-bm25({FTS_TABLE}, 10.0, 1.0)', [], output_field=FloatField()))
+    condition = Q()
+    for term in terms:
+        condition &= Q(title__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class TaskSearchFilter(BaseFilterBackend):
+    """``?search=`` over title and description, best matches first unless ``?ordering=`` is given."""
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        queryset = search_tasks(queryset, query)
+        if 'ordering' not in request.query_params:
+            queryset = queryset.order_by('-search_rank', 'id')
+        return queryset
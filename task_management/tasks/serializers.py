@@ -1,7 +1,5 @@
 from rest_framework import serializers
-from .models import Task, Category, TaskHistory, Notification, SharedTask
-from django.utils import timezone
-from datetime import timedelta
+from .models import Task, Category, TaskHistory, TaskOccurrence, Notification, SharedTask
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -11,19 +9,66 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name']
 
+class CategoryField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        # Bulk requests preload the referenced categories into the context instead of a query per item
+        categories = self.context.get('categories')
+        if categories is None:
+            return super().to_internal_value(data)
+        try:
+            return categories[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+class TaskListSerializer(serializers.ListSerializer):
+    def run_child_validation(self, data):
+        # Bulk updates validate each item against its task, preloaded into the context by id
+        instances = self.context.get('instances', {})
+        self.child.instance = instances.get(data.get('id')) if isinstance(data, dict) else None
+        self.child.initial_data = data
+        return super().run_child_validation(data)
+
 class TaskSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
-    category_id = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), source='category', write_only=True)
+    category_id = CategoryField(queryset=Category.objects.all(), source='category', write_only=True)
     shared_with_users = serializers.SerializerMethodField()
 
     class Meta:
         model = Task
-        fields = ['id', 'title', 'description', 'due_date', 'priority', 'status', 'completed_at', 'category', 'category_id', 'recurrence', 'next_due_date', 'user', 'shared_with_users']
-        read_only_fields = ['completed_at', 'next_due_date', 'user', 'shared_with_users']
+        fields = ['id', 'title', 'description', 'due_date', 'priority', 'status', 'completed_at', 'category', 'category_id', 'recurrence', 'next_due_date', 'updated_at', 'user', 'shared_with_users']
+        read_only_fields = ['completed_at', 'next_due_date', 'updated_at', 'user', 'shared_with_users']
+        list_serializer_class = TaskListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sparse fieldsets: TaskViewSet puts the fields picked by ?fields= / ?omit= into the context
+        requested = self.context.get('fields')
+        if requested is not None:
+            for name in [name for name, field in self.fields.items() if not field.write_only and name not in requested]:
+                self.fields.pop(name)
+
+    @classmethod
+    def readable_fields(cls):
+        return [name for name, field in cls().fields.items() if not field.write_only]
+
+    @classmethod
+    def select_fields(cls, fields=None, omit=None):
+        """Resolve comma-separated ``fields`` / ``omit`` lists into the set of fields to render."""
+        readable = cls.readable_fields()
+        fields = [name for name in (fields or '').split(',') if name]
+        omit = [name for name in (omit or '').split(',') if name]
+        unknown = [name for name in fields + omit if name not in readable]
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(readable)}."})
+        return set(fields or readable) - set(omit)
 
     def get_shared_with_users(self, obj):
-        shared_tasks = SharedTask.objects.filter(task=obj)
-        return [shared_task.shared_with.username for shared_task in shared_tasks]    
+        # TaskViewSet prefetches shares with their users; fall back to a single query otherwise
+        if 'sharedtask' in getattr(obj, '_prefetched_objects_cache', {}):
+            return [shared_task.shared_with.username for shared_task in obj.sharedtask.all()]
+        return list(SharedTask.objects.filter(task=obj).values_list('shared_with__username', flat=True))
     
     def validate(self, data):
         # Prevent editing of completed tasks unless reverting to Pending
@@ -32,26 +77,29 @@ class TaskSerializer(serializers.ModelSerializer):
         return data
 
     def update(self, instance, validated_data):
-        # Mark task as completed and set completed_at timestamp
-        if validated_data.get('status') == 'Completed' and instance.status != 'Completed':
-            instance.completed_at = timezone.now()
-            # Handle recurring tasks
-            if instance.recurrence != 'None':
-                if instance.recurrence == 'Daily':
-                    instance.next_due_date = instance.due_date + timedelta(days=1)
-                elif instance.recurrence == 'Weekly':
-                    instance.next_due_date = instance.due_date + timedelta(weeks=1)
-                elif instance.recurrence == 'Monthly':
-                    instance.next_due_date = instance.due_date + timedelta(days=30)
-                # Reset task for the next occurrence
-                instance.status = 'Pending'
-
-        # Revert to incomplete
-        elif validated_data.get('status') == 'Pending' and instance.status == 'Completed':
-            instance.completed_at = None
-
-        return super().update(instance, validated_data)
+        # Completing, reopening and moving the due date have side effects that bulk updates share
+        instance.apply_changes(validated_data)
+        instance.save()
+        return instance
     
+class TaskImportSerializer(serializers.ModelSerializer):
+    # Imported rows name their category; tasks.importer resolves or creates it
+    category = serializers.CharField(max_length=100, required=False)
+    description = serializers.CharField(required=False, default='')
+
+    class Meta:
+        model = Task
+        fields = ['title', 'description', 'due_date', 'priority', 'status', 'recurrence', 'category']
+
+class TaskOccurrenceSerializer(serializers.ModelSerializer):
+    title = serializers.CharField(source='task.title', read_only=True)
+    priority = serializers.CharField(source='task.priority', read_only=True)
+    recurrence = serializers.CharField(source='task.recurrence', read_only=True)
+
+    class Meta:
+        model = TaskOccurrence
+        fields = ['id', 'task', 'title', 'priority', 'recurrence', 'due_date']
+
 class TaskHistorySerializer(serializers.ModelSerializer):
     task = TaskSerializer()
     user = serializers.StringRelatedField()
@@ -60,6 +108,14 @@ class TaskHistorySerializer(serializers.ModelSerializer):
         model = TaskHistory
         fields = ['task', 'completed_at', 'user']
 
+class CompactTaskHistorySerializer(serializers.ModelSerializer):
+    title = serializers.CharField(source='task.title', read_only=True)
+    user = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = TaskHistory
+        fields = ['id', 'task', 'title', 'completed_at', 'user']
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
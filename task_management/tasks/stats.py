@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .cache import get_version
+from .models import Task, TaskHistory
+
+
+def compute_task_stats(user, days=30, today=None):
+    today = today or timezone.localdate()
+    tasks = Task.objects.visible_to(user).annotate(current_due_date=Coalesce('next_due_date', 'due_date'))
+    pending = Q(status='Pending')
+
+    totals = tasks.aggregate(
+        total=Count('id'),
+        pending=Count('id', filter=pending),
+        completed=Count('id', filter=Q(status='Completed')),
+        overdue=Count('id', filter=pending & Q(current_due_date__lt=today)),
+        due_today=Count('id', filter=pending & Q(current_due_date=today)),
+        due_this_week=Count('id', filter=pending & Q(current_due_date__range=(today, today + timedelta(days=6)))),
+        recurring=Count('id', filter=~Q(recurrence='None')),
+    )
+    by_status = dict(tasks.order_by().values_list('status').annotate(count=Count('id')))
+    by_priority = dict(tasks.order_by().values_list('priority').annotate(count=Count('id')))
+    by_category = [
+        {'id': row['category_id'], 'name': row['category__name'], 'count': row['count'], 'pending': row['pending']}
+        for row in tasks.order_by('category_id').values('category_id', 'category__name').annotate(
+            count=Count('id'), pending=Count('id', filter=pending)
+        )
+    ]
+    since = today - timedelta(days=days - 1)
+    completed_per_day = [
+        {'date': row['day'], 'count': row['count']}
+        for row in TaskHistory.objects.filter(user=user, completed_at__date__gte=since)
+        .annotate(day=TruncDate('completed_at')).order_by('day').values('day').annotate(count=Count('id'))
+    ]
+    return {
+        **totals,
+        'by_status': {choice: by_status.get(choice, 0) for choice, _ in Task.STATUS_CHOICES},
+        'by_priority': {choice: by_priority.get(choice, 0) for choice, _ in Task.PRIORITY_CHOICES},
+        'by_category': by_category,
+        'completed_per_day': completed_per_day,
+    }
+
+
+def task_stats(user, days=30):
+    # Keyed by the user's task version (moved on by every write) and the day, since overdue counts move at midnight
+    today = timezone.localdate()
+    key = f'task-stats:{user.pk}:{get_version(user.pk)}:{today}:{days}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_task_stats(user, days, today)
+        cache.set(key, stats, getattr(settings, 'TASK_STATS_CACHE_TIMEOUT', 300))
+    return stats
@@ -0,0 +1,204 @@
+"""
+Server-sent events for new notifications.
+
+``/api/notifications/stream/`` is a plain async Django view, so it must be
+served through ``task_management.asgi``: each open connection is one
+coroutine waiting on a small queue, not a worker thread. Under WSGI the
+stream would be buffered. Notifications written by tasks.notifications are
+published to a broker once their transaction commits. The default broker
+only reaches connections held by the same process, so every heartbeat also
+reads the database for notifications written elsewhere, such as the
+reminders of run_scheduler; those arrive within ``HEARTBEAT_INTERVAL``.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.dispatch import receiver
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.authentication import CachedJWTAuthentication
+from .models import Notification
+from .notifications import notifications_created
+from .serializers import NotificationSerializer
+
+HEARTBEAT_INTERVAL = 20
+REPLAY_LIMIT = 100
+QUEUE_SIZE = 1000
+
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, payload):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, payload):
+        # Safe to call from any thread; the payload is handed to each subscriber's own loop
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, payload)
+            except RuntimeError:
+                # The subscriber's loop is already closed
+                self.unsubscribe(subscription)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'NOTIFICATION_BROKER', 'tasks.streaming.InProcessBroker'))()
+    return _broker
+
+
+@receiver(setting_changed)
+def _reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'NOTIFICATION_BROKER':
+        _broker = None
+
+
+@receiver(notifications_created)
+def _publish_created(sender, notifications, **kwargs):
+    payloads = [(notification.user_id, NotificationSerializer(notification).data) for notification in notifications]
+
+    def publish():
+        broker = get_broker()
+        for user_id, payload in payloads:
+            broker.publish(user_id, payload)
+
+    transaction.on_commit(publish)
+
+
+def format_event(payload):
+    data = json.dumps(payload, cls=DjangoJSONEncoder)
+    return f'id: {payload["id"]}\nevent: notification\ndata: {data}\n\n'
+
+
+def _closing(func):
+    # Each stream's queries run in a thread of its own, which would keep its connection (and, with
+    # DATABASE_POOL, a pooled connection) for as long as the stream is open. Hand it back after
+    # every read so idle streams hold none between heartbeats.
+    def read(*args):
+        try:
+            return func(*args)
+        finally:
+            for connection in connections.all(initialized_only=True):
+                connection.close()
+    return sync_to_async(read)
+
+
+def _latest_notification_id(user_id):
+    return Notification.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _missed_notifications(user_id, last_id):
+    notifications = Notification.objects.filter(user_id=user_id, is_read=False, id__gt=last_id).order_by('id')
+    return [NotificationSerializer(notification).data for notification in notifications[:REPLAY_LIMIT]]
+
+
+async def event_stream(user_id, last_id):
+    broker = get_broker()
+    # Subscribe before replaying so nothing created in between is lost; duplicates are skipped by id
+    subscription = broker.subscribe(user_id)
+    try:
+        if last_id is None:
+            last_id, missed = await _closing(_latest_notification_id)(user_id), []
+        else:
+            missed = await _closing(_missed_notifications)(user_id, last_id)
+        yield 'retry: 3000\n\n'
+        for payload in missed:
+            last_id = payload['id']
+            yield format_event(payload)
+        while True:
+            try:
+                payload = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                # Catch up on notifications published by other processes, which this broker never sees
+                missed = await _closing(_missed_notifications)(user_id, last_id)
+                for payload in missed:
+                    last_id = payload['id']
+                    yield format_event(payload)
+                if not missed:
+                    yield ': keep-alive\n\n'
+                continue
+            if payload['id'] <= last_id:
+                continue
+            last_id = payload['id']
+            yield format_event(payload)
+            if subscription.overflowed:
+                # The client fell too far behind; it reconnects with Last-Event-ID and replays from the database
+                yield 'event: resync\ndata: {}\n\n'
+                return
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def _authenticate(request):
+    authenticator = CachedJWTAuthentication()
+    # EventSource can't send headers, so the access token may also come as ?token=
+    raw_token = request.GET.get('token')
+    try:
+        if raw_token:
+            return authenticator.get_user(authenticator.get_validated_token(raw_token.encode()))
+        result = authenticator.authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+async def notification_stream(request):
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return JsonResponse({'error': 'since must be a cursor returned by this API.'}, status=400)
+
+    response = StreamingHttpResponse(event_stream(user.pk, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
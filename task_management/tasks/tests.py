@@ -1,3 +1,1132 @@
-from django.test import TestCase
+import csv
+import io
+import json
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from task_management import db_router
+from task_management import instrumentation
+from task_management.instrumentation import fingerprint, registry
+from task_management.nplusone import NPlusOneTestMixin
+
+from . import recurrence
+from .benchmark import seed
+from .changes import encode_token, log_changes, prune
+from .loadtest import SCENARIOS, Context, compare, run_scenario
+from .models import Task, Category, Notification, NotificationCounter, SharedTask, TaskChange, TaskHistory, TaskOccurrence, TaskReminder
+from .notifications import (
+    InMemoryBackend, NotificationDispatcher, create_task_notification, create_task_notifications, get_dispatcher,
+    get_unread_count, notifications_created, task_notification,
+)
+from .scheduler import ReminderScheduler
+from .serializers import TaskHistorySerializer
+from .streaming import event_stream, get_broker
+
+User = get_user_model()
+
+
+def make_tasks(user, count, category=None, **kwargs):
+    return Task.objects.bulk_create([
+        Task(
+            title=f'Task {i}',
+            description='',
+            due_date=date.today() + timedelta(days=i),
+            priority='Medium',
+            user=user,
+            category=category,
+            **kwargs
+        )
+        for i in range(count)
+    ])
+
+
+# These add rows behind the API's back, which the response cache would not notice
+@override_settings(TASK_RESPONSE_CACHE_TIMEOUT=0)
+class TaskListQueryCountTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friends = [
+            User.objects.create_user(username=f'friend{i}', email=f'friend{i}@example.com', password='pass')
+            for i in range(3)
+        ]
+        self.category = Category.objects.create(name='Work', user=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def add_shared_tasks(self, count):
+        tasks = make_tasks(self.owner, count, category=self.category)
+        SharedTask.objects.bulk_create([
+            SharedTask(task=task, shared_with=self.friends[i % len(self.friends)]) for i, task in enumerate(tasks)
+        ])
+
+    def test_list_query_count_does_not_grow_with_tasks(self):
+        # One query for the ETag's version, one for the tasks (with categories joined) and one for the prefetched shares
+        self.add_shared_tasks(5)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/tasks/')
+        self.assertEqual(len(response.data), 5)
+
+        self.add_shared_tasks(50)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/tasks/')
+        self.assertEqual(len(response.data), 55)
+        self.assertEqual(response.data[0]['shared_with_users'], ['friend0'])
+
+    def test_retrieve_reads_shared_users(self):
+        self.add_shared_tasks(1)
+        task = Task.objects.get()
+        response = self.client.get(f'/api/tasks/{task.pk}/')
+        self.assertEqual(response.data['shared_with_users'], ['friend0'])
+
+    def test_task_shared_with_several_users_is_listed_once(self):
+        task = make_tasks(self.owner, 1)[0]
+        SharedTask.objects.bulk_create([SharedTask(task=task, shared_with=friend) for friend in self.friends])
+        response = self.client.get('/api/tasks/')
+        self.assertEqual([item['id'] for item in response.data], [task.id])
+        self.assertEqual(sorted(response.data[0]['shared_with_users']), ['friend0', 'friend1', 'friend2'])
+
+        self.client.force_authenticate(self.friends[0])
+        response = self.client.get(f'/api/tasks/{task.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_sparse_fieldsets_narrow_output_and_queries(self):
+        self.add_shared_tasks(20)
+        with CaptureQueriesContext(connection) as queries, self.assertNumQueries(2):
+            response = self.client.get('/api/tasks/?fields=id,title,due_date')
+        self.assertEqual(set(response.data[0]), {'id', 'title', 'due_date'})
+        self.assertNotIn('description', queries[-1]['sql'])
+        self.assertNotIn('tasks_category', queries[-1]['sql'])
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/tasks/?omit=shared_with_users,description&page_size=5')
+        self.assertEqual(response.data['results'][0]['category'], {'id': self.category.id, 'name': 'Work'})
+        self.assertNotIn('shared_with_users', response.data['results'][0])
+
+        task = Task.objects.first()
+        response = self.client.get(f'/api/tasks/{task.pk}/?fields=shared_with_users')
+        self.assertEqual(response.data, {'shared_with_users': ['friend0']})
+
+        response = self.client.get('/api/tasks/?fields=title,category_id,secret')
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_unpaginated_without_page_size(self):
+        make_tasks(self.user, 3)
+        response = self.client.get('/api/tasks/')
+        self.assertEqual(len(response.data), 3)
+
+    def test_walks_every_task_once_in_due_date_order(self):
+        tasks = make_tasks(self.user, 7) + make_tasks(self.user, 7)
+        ids = self.walk('/api/tasks/?page_size=3')
+        expected = [task.id for task in sorted(tasks, key=lambda task: (task.due_date, task.id))]
+        self.assertEqual(ids, expected)
+
+    def test_respects_ordering_filter(self):
+        make_tasks(self.user, 4)
+        Task.objects.filter(pk__in=Task.objects.values('pk')[:2]).update(priority='High')
+        ids = self.walk('/api/tasks/?page_size=2&ordering=-priority')
+        expected = list(Task.objects.order_by('-priority', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/tasks/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class ShareTaskTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='pass')
+        self.task = make_tasks(self.owner, 1)[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_sharing_twice_is_rejected(self):
+        url = f'/api/tasks/{self.task.pk}/share/'
+        response = self.client.post(url, {'user_id': self.friend.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(url, {'user_id': self.friend.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(SharedTask.objects.filter(task=self.task).count(), 1)
+
+
+IN_MEMORY_NOTIFICATIONS = {'BACKEND': 'tasks.notifications.InMemoryBackend', 'ASYNC': False, 'MERGE_WINDOW': 5}
+
+
+class NotificationPipelineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.category = Category.objects.create(name='Work', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def task_payload(self, **overrides):
+        return {
+            'title': 'Write report',
+            'description': 'Quarterly numbers',
+            'due_date': str(date.today() + timedelta(days=3)),
+            'priority': 'High',
+            'category_id': self.category.pk,
+            **overrides,
+        }
+
+    def test_create_and_update_write_through_the_database_backend(self):
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False, 'MERGE_WINDOW': 0}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/tasks/', self.task_payload(), format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            task_id = response.data['id']
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.put(f'/api/tasks/{task_id}/', self.task_payload(title='Write summary'), format='json')
+        messages = list(Notification.objects.filter(task_id=task_id).values_list('message', flat=True))
+        self.assertEqual(len(messages), 2)
+        self.assertIn('Write summary', messages[1])
+
+    def test_duplicates_within_window_are_merged(self):
+        task = make_tasks(self.user, 1)[0]
+        with self.settings(TASK_NOTIFICATIONS=IN_MEMORY_NOTIFICATIONS):
+            dispatcher = get_dispatcher()
+            with self.captureOnCommitCallbacks(execute=True):
+                create_task_notifications([(self.user, task), (self.user, task)], 'updated')
+                create_task_notification(self.user, task, 'created')
+            with self.captureOnCommitCallbacks(execute=True):
+                create_task_notification(self.user, task, 'updated')
+        self.assertEqual(len(dispatcher.backend.notifications), 2)
+
+    def test_background_worker_batches_and_flushes_on_shutdown(self):
+        tasks = make_tasks(self.user, 20)
+        dispatcher = NotificationDispatcher(InMemoryBackend(), batch_size=8, flush_interval=60)
+        writes = []
+        write = dispatcher.backend.write
+        dispatcher.backend.write = lambda notifications: writes.append(len(notifications)) or write(notifications)
+        dispatcher.enqueue([('created', task_notification(self.user, task)) for task in tasks])
+        dispatcher.shutdown()
+        self.assertEqual(writes, [8, 8, 4])
+        self.assertEqual(len(dispatcher.backend.notifications), 20)
+
+
+class BulkTaskOperationsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='pass')
+        self.category = Category.objects.create(name='Work', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_op(self, title):
+        return {'op': 'create', 'data': {
+            'title': title, 'description': 'Imported', 'due_date': str(date.today()),
+            'priority': 'Low', 'category_id': self.category.pk,
+        }}
+
+    def test_applies_all_operations(self):
+        update, complete, delete = make_tasks(self.user, 3)
+        Task.objects.filter(pk=complete.pk).update(recurrence='Daily')
+        operations = [
+            self.create_op('New 1'),
+            self.create_op('New 2'),
+            {'op': 'update', 'id': update.pk, 'data': {'title': 'Renamed'}},
+            {'op': 'complete', 'id': complete.pk},
+            {'op': 'delete', 'id': delete.pk},
+        ]
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False, 'MERGE_WINDOW': 0}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/tasks/bulk/', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([result['status'] for result in response.data['results']], ['ok'] * 5)
+        self.assertEqual(Task.objects.filter(title__startswith='New').count(), 2)
+        self.assertEqual(Task.objects.get(pk=update.pk).title, 'Renamed')
+        complete.refresh_from_db()
+        self.assertEqual(complete.next_due_date, complete.due_date + timedelta(days=1))
+        self.assertEqual(complete.history.count(), 1)
+        self.assertFalse(Task.objects.filter(pk=delete.pk).exists())
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_updates_follow_the_same_rules_as_a_single_edit(self):
+        reopened, recurring, moved = make_tasks(self.user, 3)
+        Task.objects.filter(pk=reopened.pk).update(status='Completed', completed_at=timezone.now())
+        Task.objects.filter(pk=recurring.pk).update(recurrence='Weekly')
+        Task.objects.filter(pk=moved.pk).update(recurrence='Daily', next_due_date=moved.due_date + timedelta(days=3))
+        operations = [
+            {'op': 'update', 'id': reopened.pk, 'data': {'status': 'Pending'}},
+            {'op': 'update', 'id': recurring.pk, 'data': {'status': 'Completed'}},
+            {'op': 'update', 'id': moved.pk, 'data': {'due_date': str(moved.due_date + timedelta(days=1))}},
+        ]
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False}), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/tasks/bulk/', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        for task in (reopened, recurring, moved):
+            task.refresh_from_db()
+        self.assertEqual((reopened.status, reopened.completed_at), ('Pending', None))
+        self.assertEqual((recurring.status, recurring.next_due_date), ('Pending', recurring.due_date + timedelta(days=7)))
+        self.assertIsNone(moved.next_due_date)
+
+    def test_invalid_operation_rolls_back_everything(self):
+        foreign = make_tasks(self.other, 1)[0]
+        operations = [
+            self.create_op('New'),
+            {'op': 'update', 'id': foreign.pk, 'data': {'title': 'Mine now'}},
+            {'op': 'create', 'data': {'title': 'Missing fields'}},
+        ]
+        response = self.client.post('/api/tasks/bulk/', operations, format='json')
+        self.assertEqual(response.status_code, 400)
+        statuses = [result['status'] for result in response.data['results']]
+        self.assertEqual(statuses, ['skipped', 'error', 'error'])
+        self.assertFalse(Task.objects.filter(user=self.user).exists())
+
+    def test_query_count_does_not_grow_with_operations(self):
+        def run(count):
+            tasks = make_tasks(self.user, count)
+            operations = [self.create_op(f'New {i}') for i in range(count)]
+            operations += [{'op': 'complete', 'id': task.pk} for task in tasks]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/tasks/bulk/', operations, format='json')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        self.assertEqual(run(3), run(30))
+
+    def test_deleting_shared_tasks_does_not_query_per_share(self):
+        def run(count):
+            tasks = make_tasks(self.user, count)
+            SharedTask.objects.bulk_create([SharedTask(task=task, shared_with=self.other) for task in tasks])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/tasks/bulk/', [{'op': 'delete', 'id': task.pk} for task in tasks], format='json')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        self.assertEqual(run(3), run(30))
+        self.assertEqual(TaskChange.objects.filter(user=self.other).count(), 33)
+
+
+class UnreadNotificationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.tasks = make_tasks(self.user, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def notify(self, *tasks):
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False, 'MERGE_WINDOW': 0}):
+            with self.captureOnCommitCallbacks(execute=True):
+                create_task_notifications([(self.user, task) for task in tasks], 'created')
+
+    def count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/notifications/unread/count/')
+        return response.data
+
+    def test_counter_follows_creation_and_reads(self):
+        Notification.objects.create(user=self.user, task=self.tasks[0], message='Created before the counter')
+        self.notify(*self.tasks)
+        self.assertEqual(self.count()['unread'], 4)
+
+        first = Notification.objects.order_by('id').first()
+        self.client.patch('/api/notifications/mark_read/', {'notification_ids': [first.pk]}, format='json')
+        self.client.patch('/api/notifications/mark_read/', {'notification_ids': [first.pk]}, format='json')
+        self.assertEqual(self.count()['unread'], 3)
+
+        self.client.delete(f'/api/tasks/{self.tasks[1].pk}/')
+        self.assertEqual(self.count()['unread'], 2)
+
+        self.client.post('/api/notifications/mark_all_read/')
+        self.assertEqual(self.count()['unread'], 0)
+
+    def test_since_returns_only_newer_notifications(self):
+        self.notify(self.tasks[0])
+        cursor = self.count()['cursor']
+        self.notify(self.tasks[1], self.tasks[2])
+
+        response = self.client.get('/api/notifications/unread/', {'since': cursor})
+        self.assertEqual(sorted(item['task'] for item in response.data['results']), [self.tasks[1].pk, self.tasks[2].pk])
+        self.assertEqual(response.data['cursor'], self.count()['cursor'])
+
+        response = self.client.get('/api/notifications/unread/', {'since': response.data['cursor']})
+        self.assertEqual(response.data['results'], [])
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, user_id, payload):
+        self.published.append((user_id, payload['task']))
+
+
+class NotificationStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.task = make_tasks(self.user, 1)[0]
+
+    def test_created_notifications_are_published_after_commit(self):
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False, 'MERGE_WINDOW': 0},
+                           NOTIFICATION_BROKER='tasks.tests.RecordingBroker'):
+            with self.captureOnCommitCallbacks(execute=True):
+                create_task_notification(self.user, self.task, 'created')
+            self.assertEqual(get_broker().published, [(self.user.pk, self.task.pk)])
+
+    def test_stream_replays_missed_notifications_then_pushes_new_ones(self):
+        seen = Notification.objects.create(user=self.user, task=self.task, message='Seen')
+        missed = Notification.objects.create(user=self.user, task=self.task, message='Missed')
+
+        async def read():
+            stream = event_stream(self.user.pk, seen.pk)
+            chunks = [await anext(stream), await anext(stream)]
+            get_broker().publish(self.user.pk, {'id': missed.pk, 'message': 'Duplicate'})
+            get_broker().publish(self.user.pk, {'id': missed.pk + 1, 'message': 'Pushed'})
+            chunks.append(await anext(stream))
+            await stream.aclose()
+            return chunks
+
+        retry, replayed, pushed = async_to_sync(read)()
+        self.assertEqual(retry, 'retry: 3000\n\n')
+        self.assertIn('"message": "Missed"', replayed)
+        self.assertTrue(pushed.startswith(f'id: {missed.pk + 1}\n'))
+        self.assertIn('"message": "Pushed"', pushed)
+
+    def test_stream_picks_up_notifications_written_by_other_processes(self):
+        Notification.objects.create(user=self.user, task=self.task, message='Old')
+
+        async def read():
+            stream = event_stream(self.user.pk, None)
+            chunks = [await anext(stream)]
+            # Written by run_scheduler, whose broker this process never hears from
+            await sync_to_async(Notification.objects.create)(user=self.user, task=self.task, message='Reminder')
+            chunks.append(await anext(stream))
+            await stream.aclose()
+            return chunks
+
+        with mock.patch('tasks.streaming.HEARTBEAT_INTERVAL', 0.01):
+            _, reminder = async_to_sync(read)()
+        self.assertIn('"message": "Reminder"', reminder)
+
+    def test_streams_hold_no_connection_between_heartbeats(self):
+        Notification.objects.create(user=self.user, task=self.task, message='Old')
+
+        async def read():
+            stream = event_stream(self.user.pk, None)
+            # Past the opening read, then two heartbeats that each check the database
+            for _ in range(3):
+                await anext(stream)
+                closes.append(closed.call_count)
+            await stream.aclose()
+
+        closes = []
+        # The in-memory test database ignores close(), so count the calls instead
+        with mock.patch.object(connection, 'close', wraps=connection.close) as closed, \
+                mock.patch('tasks.streaming.HEARTBEAT_INTERVAL', 0.01), CaptureQueriesContext(connection) as queries:
+            async_to_sync(read)()
+        # One query per read, each followed by closing the connection before the stream waits again
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(closes, [1, 2, 3])
+
+    def test_stream_requires_a_token(self):
+        response = self.client.get('/api/notifications/stream/')
+        self.assertEqual(response.status_code, 401)
+
+
+class RecurrenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rules_use_calendar_months_and_skip_weekends(self):
+        self.assertEqual(
+            recurrence.occurrences('Monthly', date(2024, 1, 31), date(2024, 1, 31), 4),
+            [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30)],
+        )
+        self.assertEqual(
+            recurrence.occurrences('Weekdays', date(2024, 6, 7), date(2024, 6, 8), 2),
+            [date(2024, 6, 10), date(2024, 6, 11)],
+        )
+        self.assertEqual(recurrence.next_occurrence('Yearly', date(2024, 2, 29), date(2024, 2, 29)), date(2025, 2, 28))
+
+    def test_completing_walks_the_series_and_rolls_occurrences_forward(self):
+        today = date.today()
+        response = self.client.post('/api/tasks/', {
+            'title': 'Standup', 'description': 'Daily', 'due_date': str(today), 'priority': 'Low',
+            'recurrence': 'Daily', 'category_id': Category.objects.create(name='Work', user=self.user).pk,
+        }, format='json')
+        task = Task.objects.get(pk=response.data['id'])
+        self.assertEqual(TaskOccurrence.objects.filter(task=task).count(), 10)
+
+        for days in (1, 2):
+            self.client.patch(f'/api/tasks/{task.pk}/mark_complete/')
+            task.refresh_from_db()
+            self.assertEqual((task.status, task.next_due_date), ('Pending', today + timedelta(days=days)))
+        dates = list(TaskOccurrence.objects.filter(task=task).order_by('due_date').values_list('due_date', flat=True))
+        self.assertEqual(dates, [today + timedelta(days=days) for days in range(2, 12)])
+
+        response = self.client.patch(f'/api/tasks/{task.pk}/', {'status': 'Completed'}, format='json')
+        self.assertEqual(response.data['status'], 'Pending')
+        self.assertEqual(response.data['next_due_date'], str(today + timedelta(days=3)))
+
+    def test_upcoming_lists_owned_and_shared_occurrences_in_range(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pass')
+        today = date.today()
+        weekly = make_tasks(self.user, 1, recurrence='Weekly')[0]
+        shared = make_tasks(other, 1, recurrence='Daily')[0]
+        hidden = make_tasks(other, 1, recurrence='Daily')[0]
+        SharedTask.objects.create(task=shared, shared_with=self.user)
+        TaskOccurrence.objects.sync([weekly, shared, hidden])
+
+        response = self.client.get('/api/tasks/upcoming/', {'start': str(today), 'end': str(today + timedelta(days=6))})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['task'] for item in response.data].count(weekly.pk), 1)
+        self.assertEqual([item['task'] for item in response.data].count(shared.pk), 7)
+        self.assertNotIn(hidden.pk, [item['task'] for item in response.data])
+        self.assertEqual(self.client.get('/api/tasks/upcoming/', {'start': 'soon'}).status_code, 400)
+
+
+class ReminderSchedulerTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='pass')
+        self.today = date.today()
+
+    def test_reminders_are_sent_once_and_overdue_series_roll_over(self):
+        due = Task.objects.create(title='Due', description='', due_date=self.today + timedelta(days=1), priority='Low', user=self.owner)
+        late = Task.objects.create(title='Late', description='', due_date=self.today - timedelta(days=3), priority='Low', user=self.owner)
+        series = Task.objects.create(title='Series', description='', due_date=self.today - timedelta(days=14),
+                                     priority='Low', user=self.owner, recurrence='Weekly')
+        Task.objects.create(title='Later', description='', due_date=self.today + timedelta(days=5), priority='Low', user=self.owner)
+        Task.objects.create(title='Done', description='', due_date=self.today, priority='Low', user=self.owner, status='Completed')
+        SharedTask.objects.create(task=due, shared_with=self.friend)
+
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False}), self.captureOnCommitCallbacks(execute=True):
+            totals = ReminderScheduler(lead_days=1, batch_size=2).run()
+        # The series is reminded it is overdue, then that its next occurrence (today) is due
+        self.assertEqual(totals, {'reminders': 4, 'notifications': 5, 'rolled_over': 1})
+        series.refresh_from_db()
+        self.assertEqual(series.next_due_date, self.today)
+        self.assertEqual(
+            set(TaskReminder.objects.values_list('task_id', 'due_date', 'kind')),
+            {(due.pk, due.due_date, 'due'), (late.pk, late.due_date, 'overdue'),
+             (series.pk, series.due_date, 'overdue'), (series.pk, self.today, 'due')},
+        )
+        self.assertEqual(Notification.objects.filter(user=self.friend).get().message, f'Task "Due" is due on {due.due_date}.')
+        self.assertEqual(get_unread_count(self.owner)[0], 4)
+
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False}):
+            self.assertEqual(ReminderScheduler(lead_days=1).run(), {'reminders': 0, 'notifications': 0, 'rolled_over': 0})
+
+
+    def test_rolled_over_series_are_reminded_of_their_new_occurrence_in_the_same_run(self):
+        series = Task.objects.bulk_create([
+            Task(title=f'Series {i}', description='', due_date=self.today - timedelta(days=10), priority='Low',
+                 user=self.owner, recurrence='Daily')
+            for i in range(3)
+        ])
+        # Claimed in the same batch, which moves the keyset past today
+        Task.objects.create(title='Tomorrow', description='', due_date=self.today + timedelta(days=1), priority='Low', user=self.owner)
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False}), self.captureOnCommitCallbacks(execute=True):
+            totals = ReminderScheduler(lead_days=1, batch_size=10).run()
+            self.assertEqual(totals, {'reminders': 7, 'notifications': 7, 'rolled_over': 3})
+            self.assertEqual(ReminderScheduler(lead_days=1).run()['reminders'], 0)
+        self.assertEqual(
+            set(TaskReminder.objects.filter(kind='due', task__in=series).values_list('task_id', 'due_date')),
+            {(task.pk, self.today) for task in series},
+        )
+
+    def test_batches_do_not_rescan_overdue_tasks_already_reminded(self):
+        Task.objects.bulk_create([
+            Task(title=f'Late {i}', description='', due_date=self.today - timedelta(days=30), priority='Low', user=self.owner)
+            for i in range(20)
+        ])
+        TaskReminder.objects.bulk_create([TaskReminder(task=task, due_date=task.due_date, kind='overdue') for task in Task.objects.all()])
+        Task.objects.bulk_create([
+            Task(title=f'Due {i}', description='', due_date=self.today, priority='Low', user=self.owner) for i in range(20)
+        ])
+        scheduler = ReminderScheduler(lead_days=1, batch_size=5)
+        with mock.patch.object(scheduler, 'run_batch', wraps=scheduler.run_batch) as run_batch, \
+                self.settings(TASK_NOTIFICATIONS={'ASYNC': False}), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(scheduler.run()['reminders'], 20)
+        # Each batch starts where the previous one stopped, past the reminded tasks
+        afters = [call.args[1] for call in run_batch.call_args_list]
+        self.assertEqual(afters[0], None)
+        self.assertEqual([due for due, _ in afters[1:]], [self.today] * 4)
+        self.assertEqual(len({task_id for _, task_id in afters[1:]}), 4)
+
+
+class TaskStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.category = Category.objects.create(name='Work', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_counts_are_aggregated_and_cached_until_a_task_changes(self):
+        today = date.today()
+        pending, done, _ = make_tasks(self.user, 3, category=self.category)
+        Task.objects.filter(pk=pending.pk).update(due_date=today - timedelta(days=1), priority='High')
+        Task.objects.filter(pk=done.pk).update(status='Completed')
+        TaskHistory.objects.create(task=done, user=self.user, completed_at=timezone.now())
+
+        stats = self.client.get('/api/tasks/stats/').data
+        self.assertEqual((stats['total'], stats['pending'], stats['completed'], stats['overdue']), (3, 2, 1, 1))
+        self.assertEqual(stats['by_priority'], {'Low': 0, 'Medium': 2, 'High': 1})
+        self.assertEqual(stats['by_category'], [{'id': self.category.pk, 'name': 'Work', 'count': 3, 'pending': 2}])
+        self.assertEqual(stats['completed_per_day'], [{'date': today, 'count': 1}])
+
+        # Only the version is read
+        with self.assertNumQueries(1):
+            self.client.get('/api/tasks/stats/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/tasks/{pending.pk}/mark_complete/')
+        self.assertEqual(self.client.get('/api/tasks/stats/').data['completed'], 2)
+
+
+class TaskHistoryListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='pass')
+        self.category = Category.objects.create(name='Work', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_history(self, count):
+        tasks = make_tasks(self.user, count, category=self.category)
+        SharedTask.objects.bulk_create([SharedTask(task=task, shared_with=self.friend) for task in tasks])
+        TaskHistory.objects.bulk_create([TaskHistory(task=task, user=self.user, completed_at=timezone.now()) for task in tasks])
+
+    def test_compact_rows_in_one_query(self):
+        self.add_history(3)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/task_history/')
+        self.assertEqual(set(response.data[0]), {'id', 'task', 'title', 'completed_at', 'user'})
+        self.assertEqual(response.data[0]['user'], 'owner')
+
+        self.add_history(30)
+        with self.assertNumQueries(1):
+            self.client.get('/api/task_history/')
+
+    def test_expanded_task_query_count_does_not_grow(self):
+        self.add_history(3)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/task_history/', {'expand': 'task'})
+        self.assertEqual(response.data[0]['task']['category']['name'], 'Work')
+        self.assertEqual(response.data[0]['task']['shared_with_users'], ['friend'])
+
+        self.add_history(30)
+        with self.assertNumQueries(2):
+            self.client.get('/api/task_history/', {'expand': 'task'})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.category = Category.objects.create(name='Work, home', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_tasks_stream_as_csv_and_honor_filters(self):
+        tasks = make_tasks(self.user, 5, category=self.category)
+        Task.objects.filter(pk=tasks[0].pk).update(status='Completed')
+        response = self.client.get('/api/tasks/export/', {'status': 'Pending'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tasks.csv"')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([int(row['id']) for row in rows], [task.pk for task in tasks[1:]])
+        self.assertEqual(rows[0]['category_name'], 'Work, home')
+
+    def test_history_streams_as_ndjson(self):
+        task = make_tasks(self.user, 1)[0]
+        TaskHistory.objects.create(task=task, user=self.user, completed_at=timezone.now())
+        response = self.client.get('/api/task_history/export/', {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['task'], row['title'], row['user']) for row in rows], [(task.pk, 'Task 0', 'owner')])
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.work = Category.objects.create(name='Work', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, name, content, **data):
+        return self.client.post('/api/tasks/import/', {'file': SimpleUploadedFile(name, content.encode()), **data})
+
+    def test_csv_rows_are_imported_and_errors_reported_per_row(self):
+        content = (
+            'title,description,due_date,priority,category\n'
+            'Write report,,2030-01-01,High,Work\n'
+            'Buy milk,"2%, not whole",2030-01-02,Low,Home\n'
+            'No date,,,Low,Home\n'
+            'Call mom,,2030-01-03,Urgent,\n'
+        )
+        with self.assertNumQueries(6):
+            response = self.upload('tasks.csv', content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 2))
+        self.assertEqual([(error['row'], list(error['errors'])) for error in response.data['errors']],
+                         [(3, ['due_date']), (4, ['priority'])])
+        self.assertEqual(Task.objects.get(title='Write report').category, self.work)
+        self.assertEqual(Task.objects.get(title='Buy milk').category.name, 'Home')
+        self.assertEqual(Category.objects.filter(user=self.user).count(), 2)
+
+    def test_malformed_ndjson_lines_are_reported_and_skipped(self):
+        content = (
+            '{"title": "First", "due_date": "2030-01-01", "priority": "Low"}\n'
+            '{"title": "Broken", "due_date": \n'
+            '\n'
+            '{"title": "Last", "due_date": "2030-01-02", "priority": "Low"}\n'
+        )
+        response = self.upload('tasks.ndjson', content)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 1))
+        self.assertEqual(response.data['errors'][0]['row'], 2)
+        self.assertIn('Invalid JSON', response.data['errors'][0]['errors']['non_field_errors'][0])
+        self.assertEqual(set(Task.objects.values_list('title', flat=True)), {'First', 'Last'})
+
+    def test_json_array_is_parsed_across_reads(self):
+        rows = [{'title': f'Task {i}', 'due_date': '2030-01-01', 'priority': 'Low', 'recurrence': 'Daily'} for i in range(300)]
+        with mock.patch('tasks.importer.READ_SIZE', 100):
+            response = self.upload('tasks.json', json.dumps(rows))
+        self.assertEqual((response.data['created'], response.data['failed']), (300, 0))
+        self.assertTrue(TaskOccurrence.objects.filter(task__user=self.user).exists())
+
+        response = self.upload('tasks.txt', '{"title": "Not an array"}', format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TaskSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        return [item['title'] for item in self.client.get('/api/tasks/', params).data]
+
+    def test_ranked_search_combines_with_filters_and_follows_writes(self):
+        body, title, done, other = make_tasks(self.user, 4)
+        Task.objects.filter(pk=body.pk).update(title='Groceries', description='Remember the quarterly report')
+        Task.objects.filter(pk=title.pk).update(title='Quarterly report', description='Numbers for Q3')
+        Task.objects.filter(pk=done.pk).update(title='Old quarterly report', status='Completed')
+        foreign = make_tasks(User.objects.create_user(username='other', email='other@example.com', password='pass'), 1)[0]
+        Task.objects.filter(pk=foreign.pk).update(description='quarterly report')
+
+        # Title matches rank above description matches; "reports" is stemmed
+        results = self.search(search='quarterly reports')
+        self.assertEqual(sorted(results[:2]), ['Old quarterly report', 'Quarterly report'])
+        self.assertEqual(results[2:], ['Groceries'])
+        self.assertEqual(self.search(search='report', status='Pending', ordering='-due_date'), ['Quarterly report', 'Groceries'])
+        self.assertEqual(self.search(search='"report" OR NOT'), [])
+
+        Task.objects.filter(pk=other.pk).update(title='Report card')
+        Task.objects.filter(pk=title.pk).delete()
+        self.assertEqual(self.search(search='report', status='Pending'), ['Report card', 'Groceries'])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='pass')
+        self.task = make_tasks(self.owner, 1)[0]
+        SharedTask.objects.create(task=self.task, shared_with=self.friend, can_edit=True)
+        self.client = APIClient()
+
+    def get(self, user, url, etag=None):
+        self.client.force_authenticate(user)
+        return self.client.get(url, headers={'If-None-Match': etag} if etag else {})
+
+    def test_unchanged_tasks_are_not_modified_until_a_write(self):
+        etags = {}
+        for user in (self.owner, self.friend):
+            for url in ('/api/tasks/', f'/api/tasks/{self.task.pk}/', '/api/tasks/?status=Pending'):
+                response = self.get(user, url)
+                self.assertEqual(response.status_code, 200)
+                etags[user, url] = response['ETag']
+                # Only the version is read
+                with self.assertNumQueries(1):
+                    self.assertEqual(self.get(user, url, response['ETag']).status_code, 304)
+        self.assertEqual(len(set(etags.values())), 6)
+
+        self.client.force_authenticate(self.friend)
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False}), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/tasks/{self.task.pk}/', {'title': 'Renamed'}, format='json')
+        self.assertNotEqual(response.data['updated_at'], None)
+        for (user, url), etag in etags.items():
+            self.assertEqual(self.get(user, url, etag).status_code, 200)
+
+    def test_any_etag_needs_the_task_to_exist(self):
+        self.assertEqual(self.get(self.owner, f'/api/tasks/{self.task.pk}/', '*').status_code, 304)
+        self.assertEqual(self.get(self.owner, '/api/tasks/99999/', '*').status_code, 404)
+        self.assertEqual(self.get(self.owner, '/api/tasks/99999/', self.get(self.owner, '/api/tasks/')['ETag']).status_code, 404)
+
+    def test_notifications_change_with_reads(self):
+        Notification.objects.create(user=self.owner, task=self.task, message='Due soon')
+        etag = self.get(self.owner, '/api/notifications/')['ETag']
+        self.assertEqual(self.get(self.owner, '/api/notifications/', etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/notifications/mark_all_read/')
+        self.assertEqual(self.get(self.owner, '/api/notifications/', etag).status_code, 200)
+
+    def test_versions_are_shared_by_every_process(self):
+        # Another process, such as run_scheduler, writes the database but not this process's cache
+        etag = self.get(self.owner, '/api/tasks/')['ETag']
+        notifications_etag = self.get(self.owner, '/api/notifications/')['ETag']
+        log_changes([(self.owner.pk, self.task.pk)])
+        notifications_created.send(sender=Notification, notifications=[
+            Notification.objects.create(user=self.owner, task=self.task, message='Due soon')
+        ])
+        self.assertEqual(self.get(self.owner, '/api/tasks/', etag).status_code, 200)
+        self.assertEqual(self.get(self.owner, '/api/notifications/', notifications_etag).status_code, 200)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='pass')
+        self.category = Category.objects.create(name='Work', user=self.owner)
+        self.task = make_tasks(self.owner, 1, category=self.category)[0]
+        self.client = APIClient()
+
+    def get(self, user, url):
+        self.client.force_authenticate(user)
+        return self.client.get(url)
+
+    def write(self, user, method, url, data=None):
+        self.client.force_authenticate(user)
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False}), self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(url, data, format='json')
+
+    def test_lists_and_tasks_are_served_from_the_cache_until_a_write(self):
+        for url in ('/api/tasks/', f'/api/tasks/{self.task.pk}/', '/api/tasks/?fields=id,title', '/api/tasks/?status=Completed'):
+            first = self.get(self.owner, url)
+            # Only the version is read, once for both the ETag and the cache key
+            with self.assertNumQueries(1):
+                self.assertEqual(self.get(self.owner, url).data, first.data)
+        self.assertEqual(self.get(self.owner, '/api/tasks/?status=Completed').data, [])
+        # Cached per user: the friend cannot see the task
+        self.assertEqual(self.get(self.friend, '/api/tasks/').data, [])
+        self.assertEqual(self.get(self.friend, f'/api/tasks/{self.task.pk}/').status_code, 404)
+
+        self.write(self.owner, 'patch', f'/api/tasks/{self.task.pk}/', {'title': 'Renamed'})
+        self.assertEqual(self.get(self.owner, '/api/tasks/').data[0]['title'], 'Renamed')
+        self.assertEqual(self.get(self.owner, f'/api/tasks/{self.task.pk}/').data['title'], 'Renamed')
+
+        self.write(self.owner, 'patch', f'/api/categories/{self.category.pk}/', {'name': 'Office'})
+        self.assertEqual(self.get(self.owner, f'/api/tasks/{self.task.pk}/').data['category']['name'], 'Office')
+
+    def test_changes_made_by_other_processes_invalidate_the_cache(self):
+        self.get(self.owner, '/api/tasks/')
+        # Another process writes the task and its change log, without touching this process's cache
+        Task.objects.filter(pk=self.task.pk).update(title='Renamed elsewhere')
+        log_changes([(self.owner.pk, self.task.pk)])
+        self.assertEqual(self.get(self.owner, '/api/tasks/').data[0]['title'], 'Renamed elsewhere')
+
+    def test_sharing_invalidates_the_owner_and_the_sharee(self):
+        self.get(self.owner, '/api/tasks/')
+        self.get(self.friend, '/api/tasks/')
+        response = self.write(self.owner, 'post', f'/api/tasks/{self.task.pk}/share/', {'user_id': self.friend.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(self.owner, '/api/tasks/').data[0]['shared_with_users'], ['friend'])
+        self.assertEqual([task['id'] for task in self.get(self.friend, '/api/tasks/').data], [self.task.pk])
+
+        self.write(self.friend, 'patch', f'/api/tasks/{self.task.pk}/mark_complete/')
+        self.assertEqual(self.get(self.owner, f'/api/tasks/{self.task.pk}/').data['status'], 'Completed')
+
+
+class TaskChangesTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='pass')
+        self.client = APIClient()
+
+    def changes(self, user, token=None):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/tasks/changes/', {'since': token} if token else {})
+        return response.data
+
+    def create(self, title):
+        self.client.force_authenticate(self.owner)
+        response = self.client.post('/api/tasks/', {
+            'title': title, 'description': 'Synced', 'due_date': str(date.today()), 'priority': 'Low',
+            'category_id': Category.objects.get_or_create(name='Work', user=self.owner)[0].pk,
+        }, format='json')
+        return response.data['id']
+
+    def test_changes_cover_writes_shares_and_deletes_since_the_token(self):
+        kept, shared, deleted = self.create('Kept'), self.create('Shared'), self.create('Deleted')
+        owner_token = self.changes(self.owner)['token']
+        friend_token = self.changes(self.friend)['token']
+
+        self.client.force_authenticate(self.owner)
+        self.client.post(f'/api/tasks/{shared}/share/', {'user_id': self.friend.pk}, format='json')
+        self.client.patch(f'/api/tasks/{shared}/', {'title': 'Shared and renamed'}, format='json')
+        self.client.delete(f'/api/tasks/{deleted}/')
+
+        data = self.changes(self.owner, owner_token)
+        self.assertEqual([task['title'] for task in data['changed']], ['Shared and renamed'])
+        self.assertEqual(data['changed'][0]['shared_with_users'], ['friend'])
+        self.assertEqual(data['deleted'], [deleted])
+        self.assertNotIn(kept, data['deleted'])
+        self.assertEqual(self.changes(self.owner, data['token'])['changed'], [])
+
+        data = self.changes(self.friend, friend_token)
+        self.assertEqual([task['id'] for task in data['changed']], [shared])
+        SharedTask.objects.filter(task_id=shared).delete()
+        data = self.changes(self.friend, data['token'])
+        self.assertEqual((data['changed'], data['deleted']), ([], [shared]))
+
+    def test_deleting_a_user_logs_the_other_side_of_their_shares(self):
+        owned, borrowed = make_tasks(self.owner, 3), make_tasks(self.friend, 2)
+        SharedTask.objects.bulk_create(
+            [SharedTask(task=task, shared_with=self.friend) for task in owned]
+            + [SharedTask(task=task, shared_with=self.owner) for task in borrowed]
+        )
+        token = self.changes(self.owner)['token']
+        self.friend.delete()
+        connection.check_constraints()
+        data = self.changes(self.owner, token)
+        self.assertEqual(sorted(task['id'] for task in data['changed']), [task.pk for task in owned])
+        self.assertEqual(sorted(data['deleted']), [task.pk for task in borrowed])
+
+    def test_deleting_a_user_does_not_query_per_share(self):
+        def delete_owner(count):
+            owner = User.objects.create_user(username=f'owner{count}', email=f'owner{count}@example.com', password='pass')
+            SharedTask.objects.bulk_create([SharedTask(task=task, shared_with=self.friend) for task in make_tasks(owner, count)])
+            with CaptureQueriesContext(connection) as queries:
+                owner.delete()
+            connection.check_constraints()
+            return len(queries)
+
+        self.assertEqual(delete_owner(5), delete_owner(50))
+        # The friend lost all 55 tasks
+        self.assertEqual(TaskChange.objects.filter(user=self.friend).count(), 55)
+
+    def test_expired_and_invalid_tokens(self):
+        self.create('Old')
+        self.create('Older')
+        TaskChange.objects.update(created_at=timezone.now() - timedelta(days=40))
+        # The latest change is kept as the owner's version
+        self.assertEqual(prune(), 1)
+        self.assertEqual(prune(), 0)
+        old_token = encode_token(0, timezone.now() - timedelta(days=31))
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get('/api/tasks/changes/', {'since': old_token}).status_code, 410)
+        self.assertEqual(self.client.get('/api/tasks/changes/', {'since': 'yesterday'}).status_code, 400)
+
+
+class LoadTestScenarioTests(TestCase):
+    def test_every_scenario_succeeds_and_regressions_are_flagged(self):
+        cache.clear()
+        user = seed(users=2, tasks_per_user=30, notifications_per_user=10, recurring_ratio=0.2)[0]
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False}):
+            ctx = Context(user)
+            results = {'scenarios': {name: run_scenario(request, ctx, requests=2, warmup=1) for name, request in SCENARIOS}}
+        self.assertEqual(results['scenarios']['tasks.list.not_modified']['queries_per_request'], 1)
+        # Lists are measured without the response cache, which has a scenario of its own
+        self.assertEqual(results['scenarios']['tasks.list']['queries_per_request'], 3)
+        self.assertEqual(results['scenarios']['tasks.list.cached']['queries_per_request'], 1)
+
+        slower = json.loads(json.dumps(results))
+        slower['scenarios']['tasks.list']['p95_ms'] += 100
+        slower['scenarios']['tasks.retrieve']['queries_per_request'] += 1
+        _, regressions = compare(results, slower)
+        self.assertEqual(regressions, ['tasks.list', 'tasks.retrieve'])
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        make_tasks(self.user, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        registry.clear()
+        cache.clear()
+
+    def test_requests_are_counted_per_view_with_their_queries(self):
+        self.client.get('/api/tasks/')
+        self.client.get('/api/task_history/')
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('http_requests_total{method="GET",status="200",view="task-list"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{view="taskhistory-list"} 1', metrics)
+        # The task list reads the user's version and the tasks, and prefetches their shares
+        self.assertIn('db_queries_per_request_bucket{view="task-list",le="3"} 1', metrics)
+        self.assertIn('db_queries_per_request_bucket{view="task-list",le="2"} 0', metrics)
+        self.assertIn('serialization_duration_seconds_count{view="task-list"} 1', metrics)
+
+        with self.settings(INSTRUMENTATION={'METRICS_TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_sampled_slow_requests_are_logged_with_query_fingerprints(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        with self.settings(INSTRUMENTATION={'SLOW_REQUEST_MS': 0, 'SQL_SAMPLE_RATE': 1}):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            with self.assertLogs('task_management.instrumentation', 'WARNING') as logs:
+                client.get('/api/tasks/')
+        self.assertIn('(task-list)', logs.output[0])
+        self.assertIn('1x', logs.output[0])
+        self.assertIn('FROM "tasks_sharedtask"', logs.output[0])
+
+    def test_connection_pools_are_reported_per_database(self):
+        pool = mock.Mock(**{'get_stats.return_value': {'pool_size': 4, 'pool_available': 1, 'requests_wait_ms': 250}})
+        databases = {'default': mock.Mock(pool=pool), 'replica_0': mock.Mock(pool=None)}
+        with mock.patch.object(instrumentation, 'connections', databases):
+            metrics = registry.render()
+        self.assertIn('db_pool_size{database="default"} 4', metrics)
+        self.assertIn('db_pool_wait_seconds_total{database="default"} 0.25', metrics)
+        self.assertIn('db_pool_timeouts_total{database="default"} 0', metrics)
+        self.assertNotIn('replica_0', metrics)
+
+
+@override_settings(TASK_RESPONSE_CACHE_TIMEOUT=0)
+class NPlusOneDetectorTests(NPlusOneTestMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='pass')
+        self.category = Category.objects.create(name='Work', user=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def add_rows(self, count=10):
+        tasks = make_tasks(self.owner, count, category=self.category)
+        SharedTask.objects.bulk_create([SharedTask(task=task, shared_with=self.friend) for task in tasks])
+        TaskHistory.objects.bulk_create([TaskHistory(task=task, user=self.owner, completed_at=timezone.now()) for task in tasks])
+        Notification.objects.bulk_create([Notification(task=task, user=self.owner, message='Due') for task in tasks])
+
+    def test_list_endpoints_do_not_grow_with_rows(self):
+        self.add_rows()
+        for url in ('/api/tasks/', '/api/task_history/', '/api/task_history/?expand=task', '/api/notifications/'):
+            with self.subTest(url=url):
+                self.assertQueriesDoNotGrow(lambda: self.client.get(url), self.add_rows)
+
+    def test_bulk_writes_do_not_repeat_queries(self):
+        self.add_rows()
+        tasks = list(Task.objects.values_list('pk', flat=True))
+        operations = [
+            *({'op': 'update', 'id': pk, 'data': {'title': 'Renamed'}} for pk in tasks[:4]),
+            *({'op': 'complete', 'id': pk} for pk in tasks[4:7]),
+            *({'op': 'delete', 'id': pk} for pk in tasks[7:]),
+        ]
+        with self.settings(TASK_NOTIFICATIONS={'ASYNC': False}), self.captureOnCommitCallbacks(execute=True), \
+                self.assertNoNPlusOne(threshold=3):
+            response = self.client.post('/api/tasks/bulk/', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_cascading_deletes_do_not_repeat_queries(self):
+        self.add_rows()
+        with self.assertNoNPlusOne(threshold=3):
+            Task.objects.filter(pk__in=Task.objects.filter(user=self.owner).values('pk')[:5]).delete()
+        with self.assertNoNPlusOne(threshold=3):
+            self.owner.delete()
+        # Deleting tasks straight through the ORM is not logged; deleting their owner is
+        self.assertEqual(TaskChange.objects.filter(user=self.friend).count(), 5)
+
+    def test_repeated_queries_are_traced_to_the_serializer_field(self):
+        self.add_rows()
+        with self.assertRaises(AssertionError) as raised, self.assertNoNPlusOne():
+            TaskHistorySerializer(TaskHistory.objects.select_related('task__category'), many=True).data
+        self.assertIn('x from TaskHistorySerializer.user', str(raised.exception))
+        self.assertIn('10x from TaskSerializer.shared_with_users, tasks/serializers.py', str(raised.exception))
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # TestCase would wrap every test in a transaction on the primary, which keeps reads there
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.friend = User.objects.create_user(username='friend', email='friend@example.com', password='pass')
+        self.factory = RequestFactory()
+        cache.clear()
+        db_router._down_until.clear()
+        settings = self.settings(DATABASE_REPLICAS=['default'])
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def read_alias(self, method, user=None, status=200, **headers):
+        # The database a request through the middleware would read Task from
+        aliases = []
+
+        def view(request):
+            aliases.append(db_router.ReplicaRouter().db_for_read(Task))
+            return HttpResponse(status=status)
+
+        request = self.factory.generic(method, '/api/tasks/', **headers)
+        if user is not None:
+            request.user = user
+        db_router.ReplicaRoutingMiddleware(view)(request)
+        return aliases[0]
+
+    def test_safe_requests_read_from_a_replica_until_the_user_writes(self):
+        self.assertEqual(self.read_alias('GET', self.user), 'default')
+        self.assertIsNone(self.read_alias('POST', self.user, status=400))
+        self.assertIsNone(db_router.ReplicaRouter().db_for_read(Task))
+        # A failed write changed nothing to wait for
+        self.assertEqual(self.read_alias('GET', self.user), 'default')
+        # JWT requests are only authenticated in the view, so the middleware reads the token's claim
+        token = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.read_alias('PATCH', **token)
+        self.assertIsNone(self.read_alias('GET', self.user))
+        self.assertIsNone(self.read_alias('GET', **token))
+        self.assertEqual(self.read_alias('GET', self.friend), 'default')
+
+    def test_unread_counts_are_recounted_on_the_primary(self):
+        task = make_tasks(self.user, 1)[0]
+        Notification.objects.create(user=self.user, task=task, message='Due')
+        routed = []
+        db_for_read = db_router.ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            alias = db_for_read(router, model, **hints)
+            routed.append((model, alias))
+            return alias
+
+        token = db_router._routing.set(db_router.Routing(self.user.pk))
+        try:
+            with mock.patch.object(db_router.ReplicaRouter, 'db_for_read', record):
+                self.assertEqual(get_unread_count(self.user)[0], 1)
+        finally:
+            db_router._routing.reset(token)
+        # The counter may be read from a replica, but not the notifications it is recounted from
+        self.assertIn((NotificationCounter, 'default'), routed)
+        self.assertEqual({alias for model, alias in routed if model is Notification}, {None})
+
+    def test_unavailable_replicas_fall_back_to_the_primary(self):
+        with mock.patch.object(connection, 'ensure_connection', side_effect=OperationalError):
+            self.assertIsNone(self.read_alias('GET', self.user))
+        # Left out for a while instead of being retried on every request
+        self.assertFalse(db_router.is_up('default'))
+        self.assertIsNone(self.read_alias('GET', self.user))
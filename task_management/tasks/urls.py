@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import TaskViewSet, CategoryViewSet, TaskHistoryViewSet, NotificationViewSet
+from .streaming import notification_stream
 
 router = DefaultRouter()
 router.register(r'tasks', TaskViewSet, basename='task')
@@ -9,5 +10,7 @@ router.register(r'task_history', TaskHistoryViewSet, basename='taskhistory')
 router.register(r'notifications', NotificationViewSet, basename='notifications')
 
 urlpatterns = [
+    # Must come before the router, whose notification detail route would match "stream" as a pk
+    path('notifications/stream/', notification_stream, name='notification-stream'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
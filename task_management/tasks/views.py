@@ -1,23 +1,43 @@
 from django.shortcuts import render
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
 from rest_framework import viewsets, status
-from .models import Task, Category, TaskHistory, Notification, SharedTask
-from .serializers import TaskSerializer, CategorySerializer, TaskHistorySerializer, NotificationSerializer
+from .models import Task, Category, TaskChange, TaskHistory, TaskOccurrence, Notification, SharedTask
+from .serializers import (
+    TaskSerializer, CategorySerializer, TaskHistorySerializer, CompactTaskHistorySerializer, TaskOccurrenceSerializer,
+    NotificationSerializer,
+)
+from . import recurrence
+from .notifications import create_task_notification, get_unread_count, mark_read, recount_unread, notification_users
+from .bulk import BulkTaskOperations
+from .cache import NOTIFICATIONS
+from .changes import decode_token, encode_token, retention, tasks_changed
+from .conditional import ConditionalGetMixin
+from .response_cache import CachedResponseMixin
+from .stats import task_stats
+from .importer import PARSERS, TaskImporter, detect_format, open_upload
+from .search import TaskSearchFilter
+from .export import CSVRenderer, NDJSONRenderer, TASK_COLUMNS, HISTORY_COLUMNS, export_response
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 from django.utils import timezone
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Q
+from django.utils.dateparse import parse_date
 from django_filters import rest_framework as filters
 from rest_framework.filters import OrderingFilter
 from datetime import timedelta
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from users.authentication import CachedJWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate, get_user_model
 from rest_framework.views import APIView
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.parsers import MultiPartParser
 
 
 User = get_user_model()
 
+CHANGES_LIMIT = 1000
+
         
 
 class TaskFilter(filters.FilterSet):
@@ -39,44 +59,176 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-def create_task_notification(user, task):
-    message = f'Task "{task.title}" is due on {task.due_date}.'
-    Notification.objects.create(user=user, task=task, message=message)
+    def perform_update(self, serializer):
+        category = serializer.save()
+        tasks_changed(Task.objects.filter(category=category).only('id', 'user_id'))
+
+    def perform_destroy(self, instance):
+        tasks_changed(Task.objects.filter(category=instance).only('id', 'user_id'))
+        instance.delete()
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.DjangoFilterBackend, OrderingFilter]
+    filter_backends = [filters.DjangoFilterBackend, OrderingFilter, TaskSearchFilter]
     filterset_class = TaskFilter
     ordering_fields = ['due_date', 'priority']
-    authentication_classes = [JWTAuthentication]
+    keyset_ordering = ['due_date', 'id']
+    authentication_classes = [CachedJWTAuthentication]
 
     def perform_create(self, serializer):
         task = serializer.save(user=self.request.user)
-        create_task_notification(self.request.user, task)
+        TaskOccurrence.objects.sync([task])
+        tasks_changed([task])
+        create_task_notification(self.request.user, task, 'created')
+
+    def requested_fields(self):
+        """The fields picked by ?fields= / ?omit= on reads, or None to render them all."""
+        if not hasattr(self, '_requested_fields'):
+            params = self.request.query_params
+            self._requested_fields = None
+            if self.request.method in SAFE_METHODS and (params.get('fields') or params.get('omit')):
+                self._requested_fields = TaskSerializer.select_fields(params.get('fields'), params.get('omit'))
+        return self._requested_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.requested_fields()
+        return context
 
     def get_queryset(self):
-        user = self.request.user
-        owned_tasks = Task.objects.filter(user=user)
-        shared_tasks = Task.objects.filter(sharedtask__shared_with=user)
-        return owned_tasks | shared_tasks 
-        
+        tasks = Task.objects.visible_to(self.request.user, point_lookup=self.detail)
+        fields = self.requested_fields()
+        if fields is None or 'category' in fields:
+            tasks = tasks.select_related('category')
+        if fields is None or 'shared_with_users' in fields:
+            tasks = tasks.prefetch_related(Prefetch('sharedtask', queryset=SharedTask.objects.select_related('shared_with')))
+        if fields is not None:
+            # Load only the requested columns, plus the ones pagination and ordering read
+            columns = {'id', *self.ordering_fields, *self.keyset_ordering}
+            columns |= fields & {field.name for field in Task._meta.concrete_fields}
+            if 'category' in fields:
+                columns |= {'category__name'}
+            tasks = tasks.only(*columns)
+        return tasks
+
     
     def perform_update(self, serializer):
-        task = self.get_object()
+        task = serializer.instance
         user = self.request.user
-        create_task_notification(self.request.user, task)
         if task.status == 'Completed' and serializer.validated_data.get('status') != 'Pending':
             raise PermissionDenied("This task is marked as complete and cannot be edited.")
         
         if task.user == user or SharedTask.objects.filter(task=task, shared_with=user, can_edit=True).exists():
-            serializer.save()
-            create_task_notification(self.request.user, task)
+            task = serializer.save()
+            TaskOccurrence.objects.sync([task])
+            tasks_changed([task])
+            create_task_notification(self.request.user, task, 'updated')
         else:
             raise PermissionDenied("You don't have permission to edit this task.")
 
 
+    def perform_destroy(self, instance):
+        # Deleting the task cascades to its notifications, so recount the affected users afterwards
+        users = notification_users([instance.pk])
+        tasks_changed([instance])
+        instance.delete()
+        recount_unread(users)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        # Accepts either a list of operations or {"operations": [...]}
+        operations = request.data.get('operations') if isinstance(request.data, dict) else request.data
+        results, ok = BulkTaskOperations(request.user, operations, self.get_serializer_context()).run()
+        return Response({'results': results}, status=status.HTTP_200_OK if ok else status.HTTP_400_BAD_REQUEST)
+
+    # Imports an uploaded CSV, NDJSON or JSON array of tasks; invalid rows are skipped and reported
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_tasks(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "file is required."}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('format') or detect_format(upload.name, upload.content_type or '')
+        if file_format not in PARSERS:
+            return Response({"error": "format must be one of: csv, ndjson, json."}, status=status.HTTP_400_BAD_REQUEST)
+
+        summary = TaskImporter(request.user).run(PARSERS[file_format](open_upload(upload)))
+        ok = summary['created'] or not summary['failed']
+        return Response(summary, status=status.HTTP_200_OK if ok else status.HTTP_400_BAD_REQUEST)
+
+    # Streams every visible task matching the TaskFilter parameters as ?format=csv (default) or ?format=ndjson
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        tasks = self.filter_queryset(Task.objects.visible_to(request.user))
+        if not tasks.query.order_by:
+            tasks = tasks.order_by('due_date', 'id')
+        return export_response(request, tasks, TASK_COLUMNS, 'tasks')
+
+    # Delta sync: the tasks that changed since ?since=<token>, the ids of the ones that are gone, and the next token.
+    # Without a token it only returns one, to take before downloading the full list.
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request):
+        changes = TaskChange.objects.filter(user=request.user)
+        since = request.query_params.get('since')
+        if not since:
+            latest = changes.order_by('-id').values_list('id', flat=True).first() or 0
+            return Response({'changed': [], 'deleted': [], 'token': encode_token(latest), 'more': False})
+
+        try:
+            change_id, issued_at = decode_token(since)
+        except (ValueError, OverflowError, OSError):
+            return Response({"error": "since must be a token returned by this API."}, status=status.HTTP_400_BAD_REQUEST)
+        if issued_at < timezone.now() - retention():
+            # Changes this old may have been pruned
+            return Response({"error": "This token has expired; download the full task list again."}, status=status.HTTP_410_GONE)
+
+        rows = list(changes.filter(id__gt=change_id).order_by('id').values_list('id', 'task_id')[:CHANGES_LIMIT + 1])
+        more = len(rows) > CHANGES_LIMIT
+        rows = rows[:CHANGES_LIMIT]
+        task_ids = list(dict.fromkeys(task_id for _, task_id in rows))
+        tasks = list(self.get_queryset().filter(pk__in=task_ids).order_by('id'))
+        visible = {task.pk for task in tasks}
+        return Response({
+            'changed': self.get_serializer(tasks, many=True).data,
+            'deleted': [task_id for task_id in task_ids if task_id not in visible],
+            'token': encode_token(rows[-1][0] if rows else change_id),
+            'more': more,
+        }, status=status.HTTP_200_OK)
+
+    # Counts for dashboards, aggregated in the database and cached per user until their tasks change
+    @action(detail=False, methods=['get'], url_path='stats')
+    def stats(self, request):
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= 366:
+            return Response({"error": "days must be between 1 and 366."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(task_stats(request.user, days), status=status.HTTP_200_OK)
+
+    # Occurrences of the recurring tasks the user can see, between ?start= and ?end= (default: the next 7 days)
+    @action(detail=False, methods=['get'], url_path='upcoming')
+    def upcoming(self, request):
+        start = request.query_params.get('start')
+        end = request.query_params.get('end')
+        try:
+            start = parse_date(start) if start else timezone.localdate()
+            end = parse_date(end) if end else start and start + timedelta(days=7)
+        except ValueError:
+            start = end = None
+        if start is None or end is None:
+            return Response({"error": "start and end must be dates in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+
+        shared_ids = SharedTask.objects.filter(shared_with=request.user).values('task_id')
+        occurrences = TaskOccurrence.objects.filter(
+            Q(user=request.user) | Q(task__in=shared_ids), due_date__range=(start, end)
+        ).select_related('task').order_by('due_date', 'id')
+        page = self.paginate_queryset(occurrences)
+        if page is not None:
+            return self.get_paginated_response(TaskOccurrenceSerializer(page, many=True).data)
+        return Response(TaskOccurrenceSerializer(occurrences, many=True).data, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], url_path='share')
     def share_task(self, request, pk=None):
     # Explicitly filter by the primary key to ensure only one task is fetched
@@ -99,11 +251,13 @@ class TaskViewSet(viewsets.ModelViewSet):
             return Response({"error": "You cannot share task with yourself."}, status=status.HTTP_400_BAD_REQUEST)
 
         can_edit = request.data.get('can_edit', False)
-        if SharedTask.objects.filter(task=task, shared_with=shared_with).exists():
-            return Response({"message": f"Task is already shared with {shared_with.username}."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Share the task
-        SharedTask.objects.create(task=task, shared_with=shared_with, can_edit=can_edit)
+        # Share the task; the unique constraint on (task, shared_with) rejects duplicates
+        try:
+            with transaction.atomic():
+                SharedTask.objects.create(task=task, shared_with=shared_with, can_edit=can_edit)
+        except IntegrityError:
+            return Response({"message": f"Task is already shared with {shared_with.username}."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Return custom message with task title and username
         return Response(
@@ -117,26 +271,16 @@ class TaskViewSet(viewsets.ModelViewSet):
             task = self.get_object()
             if task.due_date is None:
                 return Response({'error': 'Task due date is missing'}, status=status.HTTP_400_BAD_REQUEST)
-            task.status = 'Completed'
-            task.completed_at = timezone.now()
+            if task.recurrence != 'None' and task.recurrence not in recurrence.RULES:
+                return Response({'error': 'Invalid recurrence type'}, status=status.HTTP_400_BAD_REQUEST)
+            task.complete()
 
             # Save the task to TaskHistory
             TaskHistory.objects.create(task=task, completed_at=task.completed_at, user=self.request.user)
 
-            # Handle recurrence
-            if task.recurrence != 'None':
-                if task.recurrence == 'Daily':
-                    task.next_due_date = task.due_date + timedelta(days=1)
-                elif task.recurrence == 'Weekly':
-                    task.next_due_date = task.due_date + timedelta(weeks=1)
-                elif task.recurrence == 'Monthly':
-                    task.next_due_date = task.due_date + timedelta(days=30)
-                else:
-                    return Response({'error': 'Invalid recurrence type'}, status=status.HTTP_400_BAD_REQUEST)    
-            
-                task.status = 'Pending'  # Reset status for the next task occurrence
-
             task.save()
+            TaskOccurrence.objects.sync([task])
+            tasks_changed([task])
             return Response({'status': 'Task marked as complete'}, status=status.HTTP_200_OK)
     
         except Task.DoesNotExist:
@@ -153,19 +297,39 @@ class TaskViewSet(viewsets.ModelViewSet):
         task.status = 'Pending'
         task.completed_at = None
         task.save()
+        TaskOccurrence.objects.sync([task])
+        tasks_changed([task])
         return Response({"message": "Task marked as incomplete."}, status=status.HTTP_200_OK)
 
 
 class TaskHistoryViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TaskHistorySerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ['-completed_at', 'id']
 
-    def get_queryset(self): 
-        return TaskHistory.objects.filter(task__user=self.request.user)
-        #return TaskHistory.objects.filter(task__user=self.request.user)
+    def expand_task(self):
+        return 'task' in self.request.query_params.get('expand', '').split(',')
 
-class NotificationViewSet(viewsets.ModelViewSet):
+    def get_serializer_class(self):
+        # Compact rows by default; ?expand=task nests the full task as before
+        return TaskHistorySerializer if self.expand_task() else CompactTaskHistorySerializer
+
+    def get_queryset(self): 
+        history = TaskHistory.objects.filter(task__user=self.request.user)
+        if self.expand_task():
+            return history.select_related('task__category', 'user').prefetch_related(
+                Prefetch('task__sharedtask', queryset=SharedTask.objects.select_related('shared_with'))
+            )
+        return history.select_related('task', 'user').only('id', 'completed_at', 'task__id', 'task__title', 'user__username')
+
+    @action(detail=False, methods=['get'], url_path='export', renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        history = TaskHistory.objects.filter(task__user=request.user).order_by('-completed_at', 'id')
+        return export_response(request, history, HISTORY_COLUMNS, 'task_history')
+
+class NotificationViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Notification.objects.all()
+    etag_scope = NOTIFICATIONS
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
 
@@ -173,17 +337,47 @@ class NotificationViewSet(viewsets.ModelViewSet):
         # Fetch notifications for the current user, sorted by creation date (newest first)
         return Notification.objects.filter(user=self.request.user).order_by('-created_at')
 
-    # Fetch unread notifications only
+    def perform_create(self, serializer):
+        notification = serializer.save()
+        recount_unread([notification.user_id])
+
+    def perform_update(self, serializer):
+        previous_user_id = serializer.instance.user_id
+        notification = serializer.save()
+        recount_unread({previous_user_id, notification.user_id})
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        recount_unread([instance.user_id])
+
+    # Fetch unread notifications only; with ?since=<cursor>, only the ones newer than the cursor
     @action(detail=False, methods=['get'], url_path='unread')
     def get_unread_notifications(self, request):
         unread_notifications = Notification.objects.filter(user=request.user, is_read=False).order_by('-created_at')
-        serializer = self.get_serializer(unread_notifications, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        since = request.query_params.get('since')
+        if since is None:
+            serializer = self.get_serializer(unread_notifications, many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({"error": "since must be a cursor returned by this API."}, status=status.HTTP_400_BAD_REQUEST)
+        new_notifications = list(unread_notifications.filter(id__gt=since))
+        serializer = self.get_serializer(new_notifications, many=True)
+        cursor = max([since] + [notification.id for notification in new_notifications])
+        return Response({'results': serializer.data, 'cursor': str(cursor)}, status=status.HTTP_200_OK)
+
+    # Cheap poll: unread count and the cursor to pass as ?since= to fetch what is new
+    @action(detail=False, methods=['get'], url_path='unread/count')
+    def unread_count(self, request):
+        unread, latest_id = get_unread_count(request.user)
+        return Response({'unread': unread, 'cursor': str(latest_id)}, status=status.HTTP_200_OK)
 
     # Mark all unread notifications as read
     @action(detail=False, methods=['post'], url_path='mark_all_read')
     def mark_all_notifications_as_read(self, request):
-        Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+        mark_read(Notification.objects.filter(user=request.user), request.user)
         return Response({"message": "All unread notifications marked as read."}, status=status.HTTP_200_OK)
 
     # Mark selected notifications as read
@@ -195,7 +389,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
         if not notifications.exists():
             return Response({"detail": "No notifications found."}, status=status.HTTP_404_NOT_FOUND)
 
-        notifications.update(is_read=True)
+        mark_read(notifications, request.user)
         return Response({"message": "Selected notifications marked as read."}, status=status.HTTP_200_OK)
         
     @api_view(['GET'])
@@ -0,0 +1,132 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+DEFAULTS = {
+    'BACKEND': 'users.authentication.LocalMemoryUserCache',
+    'TIMEOUT': 60,
+    'MAX_SIZE': 10000,
+    'CACHE_ALIAS': 'default',
+}
+
+
+class LocalMemoryUserCache:
+    """Per-process LRU cache with a TTL. Invalidation only reaches the current process."""
+
+    def __init__(self, timeout, max_size, **kwargs):
+        self.timeout = timeout
+        self.max_size = max_size
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+        # Requests may modify request.user, so never hand out the cached instance itself
+        return copy.copy(user)
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._users[user_id] = (copy.copy(user), time.monotonic() + self.timeout)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+class DjangoUserCache:
+    """Stores users in a Django cache, so invalidation is shared between processes."""
+    key_prefix = 'jwt-user:'
+
+    def __init__(self, timeout, cache_alias='default', **kwargs):
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get(self, user_id):
+        return self.cache.get(f'{self.key_prefix}{user_id}')
+
+    def set(self, user_id, user):
+        self.cache.set(f'{self.key_prefix}{user_id}', user, self.timeout)
+
+    def delete(self, user_id):
+        self.cache.delete(f'{self.key_prefix}{user_id}')
+
+
+_user_cache = None
+
+
+def get_user_cache():
+    global _user_cache
+    if _user_cache is None:
+        config = {**DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {})}
+        _user_cache = import_string(config['BACKEND'])(
+            timeout=config['TIMEOUT'],
+            max_size=config['MAX_SIZE'],
+            cache_alias=config['CACHE_ALIAS'],
+        )
+    return _user_cache
+
+
+@receiver(setting_changed)
+def _reset_user_cache(setting, **kwargs):
+    global _user_cache
+    if setting == 'JWT_USER_CACHE':
+        _user_cache = None
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _invalidate_user(sender, instance, **kwargs):
+    # Covers deactivation and password changes, which must take effect on the next request
+    get_user_cache().delete(getattr(instance, api_settings.USER_ID_FIELD))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps authenticated users in a cache keyed by user id,
+    so cheap requests don't pay for a user query each time.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        user_cache = get_user_cache()
+        user = user_cache.get(user_id)
+        if user is None:
+            # Only users that pass the active and revocation checks get cached
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+            return user
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+        return user
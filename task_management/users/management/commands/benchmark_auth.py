@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from tasks.benchmark import benchmark_database, seed
+from tasks.views import NotificationViewSet
+from users.authentication import CachedJWTAuthentication
+
+
+class Command(BaseCommand):
+    help = 'Measure requests per second on /api/notifications/unread/ with and without the cached JWT user lookup.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=50)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        original = NotificationViewSet.authentication_classes
+        with benchmark_database():
+            users = seed(users=options['users'], tasks_per_user=20, notifications_per_user=5)
+            headers = [{'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'} for user in users]
+            try:
+                for authentication in (JWTAuthentication, CachedJWTAuthentication):
+                    NotificationViewSet.authentication_classes = [authentication]
+                    self.run(authentication.__name__, headers, options['requests'])
+            finally:
+                NotificationViewSet.authentication_classes = original
+
+    def run(self, label, headers, requests):
+        client = Client()
+        # Warm up so every user is cached before measuring
+        for header in headers:
+            client.get('/api/notifications/unread/', **header)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for i in range(requests):
+                response = client.get('/api/notifications/unread/', **headers[i % len(headers)])
+                assert response.status_code == 200, response.status_code
+            elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{label}: {requests / elapsed:.0f} req/s, {len(queries) / requests:.2f} queries/request'
+        )
@@ -1,3 +1,26 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .models import CustomUser
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='pass')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_second_request_skips_the_user_query(self):
+        with self.assertNumQueries(2):
+            self.client.get('/api/notifications/unread/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/notifications/unread/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivated_user_is_rejected_immediately(self):
+        self.client.get('/api/notifications/unread/')
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/api/notifications/unread/')
+        self.assertEqual(response.status_code, 401)
@@ -12,6 +12,7 @@ class UserListView(generics.ListAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ['id']
 
 class RegisterView(APIView):
     def post(self, request):